@@ -0,0 +1,88 @@
+import argparse
+import os
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'opt',
+                                'webui'))
+
+# pylint: disable=wrong-import-position
+import app  # noqa: E402,F401  pylint: disable=unused-import
+import dispatch  # noqa: E402
+from response import HTTPError, Response  # noqa: E402
+
+REQUESTS = [
+    ('GET', '/api/search', '0&51&lib'),
+    ('GET', '/api/pkginfo', 'vim&emacs&git'),
+    ('POST', '/api/login', ''),
+    ('GET', '/api/flavors', ''),
+    ('GET', '/api/status/flavor/lecture/2025', ''),
+    ('GET', '/api/last/flavor/lecture/2025', '10'),
+    ('GET', '/api/repo', ''),
+    ('GET', '/api/repo/etc/xdg/autostart/app.desktop', ''),
+    ('PUT', '/api/repo/etc/skel/.bashrc', '644'),
+    ('POST', '/api/push', ''),
+    ('GET', '/api/no/such/route', ''),
+]
+
+
+def _noop(_req, _res, *args):
+    return args
+
+
+def _linear_dispatch(req, res):
+    for path_pat, methods in dispatch.ROUTES.values():
+        path_match = path_pat.fullmatch(req.path)
+        if path_match:
+            if req.method not in methods:
+                raise HTTPError('405 Method Not Allowed')
+            query_trans, func = methods[req.method]
+            args = dispatch._query_args(  # pylint: disable=protected-access
+                query_trans, req.query
+            )
+            return func(req, res, *path_match.groups(), *args)
+    raise HTTPError('404 Not Found')
+
+
+def _add_routes(first, last):
+    for i in range(first, last):
+        dispatch.route('GET', f'/api/extra{i}/([0-9a-z]+)')(_noop)
+
+
+def _measure(func, requests, rounds):
+    res = Response()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for req in requests:
+            try:
+                func(req, res)
+            except HTTPError:
+                pass
+    return rounds * len(requests) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure dispatch throughput')
+    parser.add_argument('-r', '--rounds', type=int, default=20000)
+    parser.add_argument('-e', '--extra-routes', type=int, nargs='*',
+                        default=[0, 50, 200])
+    args = parser.parse_args()
+    for _path_pat, methods in dispatch.ROUTES.values():
+        for method, (query_trans, _func) in methods.items():
+            methods[method] = (None if query_trans is None else
+                               lambda args: args, _noop)
+    requests = [types.SimpleNamespace(method=method, path=path, query=query)
+                for method, path, query in REQUESTS]
+    added = 0
+    print(f'{"routes":>8} {"linear req/s":>14} {"compiled req/s":>16}')
+    for extra in sorted(args.extra_routes):
+        _add_routes(added, extra)
+        added = max(added, extra)
+        linear = _measure(_linear_dispatch, requests, args.rounds)
+        compiled = _measure(dispatch.dispatch, requests, args.rounds)
+        print(f'{len(dispatch.ROUTES):8d} {linear:14.0f} {compiled:16.0f}')
+
+
+if __name__ == '__main__':
+    main()
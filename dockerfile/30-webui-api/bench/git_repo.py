@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'opt',
+                                'webui'))
+
+from git_repo import GitRepo  # noqa: E402  pylint: disable=wrong-import-position
+
+
+def _git(work_dir, *command):
+    subprocess.run(['git', *command], cwd=work_dir, check=True,
+                   stdout=subprocess.DEVNULL)
+
+
+def _create_repo(work_dir, files, pack):
+    _git(work_dir, 'init', '-q', '-b', 'main')
+    _git(work_dir, 'config', 'user.name', 'bench')
+    _git(work_dir, 'config', 'user.email', 'bench@localhost')
+    for i in range(files):
+        path = os.path.join(work_dir, 'src', f'dir{i % 16}', f'file{i}')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(f'content {i}\n' * 32)
+        os.chmod(path, 0o755 if i % 7 == 0 else 0o644)
+    manifest = {'webui': {'owners': ['bench']}, 'packages': ['vim']}
+    with open(os.path.join(work_dir, 'manifest.json'), 'w',
+              encoding='utf-8') as file:
+        json.dump(manifest, file)
+    _git(work_dir, 'add', '-A')
+    _git(work_dir, 'commit', '-q', '-m', 'initial')
+    if pack:
+        _git(work_dir, 'gc', '-q', '--aggressive')
+        with open(os.path.join(work_dir, 'src', 'dir0', 'file0'), 'a',
+                  encoding='utf-8') as file:
+            file.write('changed\n')
+        _git(work_dir, 'commit', '-q', '-am', 'loose')
+
+
+def _repo_info(repo):
+    return (repo.rev_parse(), repo.cat_file('manifest.json'),
+            repo.ls_tree('src'), repo.ls_files('src'))
+
+
+def _measure(work_dir, native, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = _repo_info(GitRepo(work_dir, native=native))
+    return (time.perf_counter() - start) / rounds, result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare native and subprocess GitRepo read paths'
+    )
+    parser.add_argument('-n', '--files', type=int, default=500)
+    parser.add_argument('-r', '--rounds', type=int, default=20)
+    parser.add_argument('--loose', action='store_true',
+                        help='keep objects loose instead of packing them')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as work_dir:
+        _create_repo(work_dir, args.files, not args.loose)
+        command, expected = _measure(work_dir, False, args.rounds)
+        native, actual = _measure(work_dir, True, args.rounds)
+    if actual != expected:
+        sys.exit('native backend returned different results')
+    print(f'files: {args.files}, rounds: {args.rounds}')
+    print(f'subprocess: {command * 1000:8.2f} ms/repo_info')
+    print(f'native:     {native * 1000:8.2f} ms/repo_info')
+    print(f'speedup:    {command / native:8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
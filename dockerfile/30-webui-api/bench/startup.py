@@ -0,0 +1,77 @@
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'opt',
+                                'webui'))
+
+
+def _environ(path, query):
+    return {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query,
+        'HTTP_HOST': 'localhost', 'wsgi.input': io.BytesIO(),
+        'wsgi.url_scheme': 'http',
+    }
+
+
+def _first_request(path, query):
+    import wsgi  # pylint: disable=import-outside-toplevel
+    status = []
+    body = wsgi.app(_environ(path, query),
+                    lambda code, _headers: status.append(code))
+    b''.join(body)
+    if hasattr(body, 'close'):
+        body.close()
+    return status[0]
+
+
+def _spawn(workers, preloaded, path, query):
+    children = []
+    for _ in range(workers):
+        read_fd, write_fd = os.pipe()
+        start = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            status = _first_request(path, query)
+            os.write(write_fd, status.encode())
+            os._exit(0)
+        os.close(write_fd)
+        children.append((pid, read_fd, start))
+    results = []
+    for pid, read_fd, start in children:
+        with os.fdopen(read_fd, 'rb') as pipe:
+            status = pipe.read().decode()
+        results.append(((time.perf_counter() - start) * 1000, status))
+        os.waitpid(pid, 0)
+    mode = 'preload' if preloaded else 'cold'
+    for i, (elapsed, status) in enumerate(results):
+        print(f'{mode:>8} {i:6d} {elapsed:10.1f} ms  {status}')
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure time from fork to first response per worker')
+    parser.add_argument('-w', '--workers', type=int, default=4)
+    parser.add_argument('-p', '--path', default='/api/search')
+    parser.add_argument('-q', '--query', default='0&50&lib')
+    args = parser.parse_args()
+    os.environ.setdefault('SECURE_COOKIE', 'false')
+    os.chdir(tempfile.mkdtemp(prefix='webui-bench-'))
+    print(f'{"mode":>8} {"worker":>6} {"first request":>13}')
+    cold = _spawn(args.workers, False, args.path, args.query)
+    start = time.perf_counter()
+    import wsgi  # noqa: F401  pylint: disable=import-outside-toplevel,unused-import
+    print(f'master import {(time.perf_counter() - start) * 1000:.1f} ms')
+    preload = _spawn(args.workers, True, args.path, args.query)
+    for mode, results in (('cold', cold), ('preload', preload)):
+        worst = max(elapsed for elapsed, _status in results)
+        print(f'{mode:>8} worst {worst:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import contextlib
+import fcntl
+import os
+import tempfile
+import threading
+import time
+import stats
+from response import ServiceUnavailable
+
+ADMISSION_DIR = os.environ.get('ADMISSION_DIR', 'admission')
+ADMISSION_LIMITS = {
+    'read': int(os.environ.get('ADMISSION_READ_MAX', '16')),
+    'clone': int(os.environ.get('ADMISSION_CLONE_MAX', '4')),
+    'push': int(os.environ.get('ADMISSION_PUSH_MAX', '2')),
+    'fanout': int(os.environ.get('ADMISSION_FANOUT_MAX', '4')),
+    'prefetch': int(os.environ.get('ADMISSION_PREFETCH_MAX', '2'))
+}
+ADMISSION_QUEUE_MAX = int(os.environ.get('ADMISSION_QUEUE_MAX', '32'))
+ADMISSION_WAIT = float(os.environ.get('ADMISSION_WAIT', '30'))
+ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', '5'))
+ADMISSION_POLL = 0.05
+
+
+def _alive(path):
+    try:
+        with open(path, 'rb') as file:
+            try:
+                fcntl.flock(file.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+    except FileNotFoundError:
+        return False
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    return False
+
+
+def _ahead(queue_dir, ticket):
+    count = 0
+    for name in sorted(os.listdir(queue_dir)):
+        if name >= ticket:
+            break
+        if not name.startswith('.') and _alive(os.path.join(queue_dir, name)):
+            count += 1
+    return count
+
+
+def _enter(queue_dir):
+    fd, tmp = tempfile.mkstemp('.tmp', '.', queue_dir)
+    file = os.fdopen(fd, 'wb')
+    try:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        ticket = (f'{time.time_ns():020d}-{os.getpid()}-'
+                  f'{threading.get_ident()}')
+        path = os.path.join(queue_dir, ticket)
+        os.rename(tmp, path)
+    except:
+        file.close()
+        os.remove(tmp)
+        raise
+    return file, ticket, path
+
+
+def _reject(kind, reason):
+    stats.incr('admission_rejections', kind=kind, reason=reason)
+    raise ServiceUnavailable('Server busy, try again later',
+                             ADMISSION_RETRY_AFTER)
+
+
+@contextlib.contextmanager
+def admit(kind, wait=None):
+    wait = ADMISSION_WAIT if wait is None else wait
+    limit = ADMISSION_LIMITS[kind]
+    queue_dir = os.path.join(ADMISSION_DIR, kind)
+    os.makedirs(queue_dir, exist_ok=True)
+    file, ticket, path = _enter(queue_dir)
+    try:
+        start = time.monotonic()
+        ahead = _ahead(queue_dir, ticket)
+        if ahead >= limit + ADMISSION_QUEUE_MAX:
+            _reject(kind, 'queue')
+        waited = False
+        while ahead >= limit:
+            if time.monotonic() - start >= wait:
+                _reject(kind, 'timeout')
+            waited = True
+            time.sleep(ADMISSION_POLL)
+            ahead = _ahead(queue_dir, ticket)
+        stats.incr('admission_requests', kind=kind,
+                   result='queued' if waited else 'immediate')
+        stats.observe('admission_wait_seconds', time.monotonic() - start,
+                      kind=kind)
+        yield
+    finally:
+        try:
+            os.remove(path)
+        finally:
+            file.close()
@@ -1,32 +1,56 @@
+import errno
+import hmac
+import importlib.util
 import json
 import os
 import re
 import shutil
+import tarfile
+import tempfile
+import threading
+import stats
+from cache import ObjectCache
 from execute import ExecuteError
 from git_server import GitServer
-from git_repo import GitRepo
-from request import UPLOAD_SIZE_MAX
-from response import BadRequest, Forbidden
+from git_repo import work_dir_lock
+from request import UPLOAD_SIZE_MAX, UPLOAD_BATCH_SIZE_MAX
+from response import BadRequest, Forbidden, HTTPError
 from session import Session, create_session
 from dispatch import route, identity, fullmatch
-
-try:
-    from pkg import apt_search, apt_list
-except ModuleNotFoundError:
-    from pkg_dummy import apt_search, apt_list
-
-try:
-    from auth import authenticate
-except ModuleNotFoundError:
+from download import send_file
+from journal import Journal, VERSION_PAT
+from watch import Watcher, WatchStream
+from fanout import fanout
+from auth_pool import AuthPool
+
+if importlib.util.find_spec('apt') is None:
+    from pkg_dummy import apt_search, apt_list, apt_preload
+else:
+    from pkg import apt_search, apt_list, apt_preload
+
+if importlib.util.find_spec('PAM') is None:
     from auth_dummy import authenticate
+else:
+    from auth import authenticate
 
 GIT_SERVER = os.environ.get('GIT_SERVER', 'localhost')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
 WEBUI = {'user': 'webui', 'email': 'webui@cluster.local'}
 REPO_RE = 'flavor(?:/[0-9A-Za-z][0-9A-Za-z_-]*)*'
 FILENAME_RE = '[^/]+(?:/[^/]+)*'
+WHITEOUT_PREFIX = '.wh.'
+WHITEOUT_OPAQUE = '.wh..wh..opq'
 REPO_PAT = re.compile(REPO_RE)
+FILENAME_PAT = re.compile(FILENAME_RE)
 PERM_PAT = re.compile('[0-7]{3}')
 PULL_FLAGS_PAT = re.compile('[ec]')
+SNAPSHOTS = ObjectCache('snapshots')
+AUTH = AuthPool(authenticate)
+ARCHIVE_TYPES = {'tar': 'application/x-tar', 'zip': 'application/zip'}
+
+
+def preload():
+    apt_preload()
 
 
 @route('GET', '/api/search', [int, int, identity])
@@ -47,7 +71,7 @@ def login(req, res):
     password = req.body.get('pass')
     if not (isinstance(user, str) and isinstance(password, str)):
         raise BadRequest()
-    if not authenticate(user, password):
+    if not AUTH.authenticate(user, password):
         raise Forbidden('Authentication failed')  # login failed
     return create_session(user, res)
 
@@ -79,6 +103,57 @@ def flavors(req, _res):
         return result
 
 
+def _repo_names(args):
+    if args == ['']:
+        return []
+    for arg in args:
+        if not REPO_PAT.fullmatch(arg):
+            raise BadRequest()
+    return [*dict.fromkeys(args)]
+
+
+def _count_repo_names(args):
+    return [int(args[0]), *_repo_names(args[1:] or [''])]
+
+
+def _ndjson(results):
+    for repo_name, result, error in results:
+        if error is None:
+            item = {'repo': repo_name, 'result': result}
+        else:
+            item = {'repo': repo_name, 'error': str(error)}
+        line = json.dumps(item, ensure_ascii=False, separators=(',', ':'))
+        yield f'{line}\n'.encode('utf-8')
+
+
+def _fanout(git, res, func, repo_names):
+    if not repo_names:
+        repo_names = [repo_name for repo_name in git.info()['repos']
+                      if REPO_PAT.fullmatch(repo_name)]
+    res.content_type = 'application/x-ndjson'
+    res.headers.append(('Cache-Control', 'no-store'))
+    return _ndjson(fanout(func, repo_names))
+
+
+@route('GET', '/api/status', _repo_names)
+def status_all(req, res, *repo_names):
+    with Session(req):
+        git = GitServer(GIT_SERVER)
+        return _fanout(git, res,
+                       lambda repo_name: git.job_status(repo_name, 'fanout'),
+                       repo_names)
+
+
+@route('GET', '/api/last', _count_repo_names)
+def last_all(req, res, count, *repo_names):
+    with Session(req):
+        git = GitServer(GIT_SERVER)
+        return _fanout(git, res,
+                       lambda repo_name: git.login_log(repo_name, count,
+                                                       'fanout'),
+                       repo_names)
+
+
 @route('GET', f'/api/status/({REPO_RE})')
 def status(req, _res, repo_name):
     with Session(req):
@@ -91,20 +166,63 @@ def log(req, _res, repo_name):
         return GitServer(GIT_SERVER).job_log(repo_name)
 
 
+def _optional_offset(args):
+    if args == ['']:
+        return [None]
+    if len(args) != 1:
+        raise BadRequest()
+    return [int(args[0])]
+
+
+@route('GET', f'/api/watch/({REPO_RE})', _optional_offset)
+def watch(req, res, repo_name, offset):
+    with Session(req):
+        last_event_id = req.get_header('Last-Event-ID')
+        if last_event_id is not None:
+            try:
+                offset = int(last_event_id)
+            except ValueError as e:
+                raise BadRequest() from e
+        watcher = Watcher(GitServer(GIT_SERVER), repo_name)
+        stream = WatchStream(watcher, max(offset or 0, 0))
+        res.content_type = 'text/event-stream'
+        res.headers.append(('Cache-Control', 'no-cache'))
+        res.headers.append(('X-Accel-Buffering', 'no'))
+        return stream
+
+
 @route('GET', f'/api/last/({REPO_RE})', [int])
 def last(req, _res, repo_name, count):
     with Session(req):
         return GitServer(GIT_SERVER).login_log(repo_name, count)
 
 
-def _repo_dir(session, must_exist=True, remove=False):
+@route('GET', '/api/stats')
+def get_stats(req, _res):
+    with Session(req):
+        return stats.snapshot()
+
+
+@route('GET', '/api/metrics')
+def get_metrics(req, res):
+    authorization = req.get_header('Authorization') or ''
+    # WSGI header values are latin-1 decoded bytes; compare them as bytes
+    if not (METRICS_TOKEN and hmac.compare_digest(
+            authorization.encode('latin-1'),
+            f'Bearer {METRICS_TOKEN}'.encode('utf-8'))):
+        with Session(req):
+            pass
+    res.content_type = 'text/plain; version=0.0.4; charset=utf-8'
+    return stats.render().encode('utf-8')
+
+
+def _repo_dir(session, must_exist=True):
     repo_dir = os.path.join(session.dir(), 'repo')
     if os.path.isdir(repo_dir):
-        if remove:
-            shutil.rmtree(repo_dir, ignore_errors=True)
-    else:
-        if must_exist:
-            raise Forbidden('Not ready')
+        return repo_dir
+    if must_exist:
+        raise Forbidden('Not ready')
+    os.makedirs(session.dir(), exist_ok=True)
     return repo_dir
 
 
@@ -115,33 +233,127 @@ def _get_revision(repo):
         return None
 
 
-def _get_manifest_json(repo, none_if_error=False):
-    try:
-        content = repo.cat_file('manifest.json')
-    except ExecuteError:
-        return None if none_if_error else {}
+def _get_manifest_json(repo):
+    if not repo.ls_tree('manifest.json'):
+        return None
     try:
-        manifest = json.loads(content)
+        manifest = json.loads(repo.cat_file('manifest.json'))
     except json.JSONDecodeError:
-        manifest = None if none_if_error else {}
-    if not isinstance(manifest, dict):
-        manifest = None if none_if_error else {}
-    return manifest
+        return None
+    return manifest if isinstance(manifest, dict) else None
 
 
-def _list_src_files(repo, ls_files=False):
-    try:
-        files = repo.ls_files('src') if ls_files else repo.ls_tree('src')
-    except ExecuteError:
-        return {}
+def _src_files(files):
     result = {}
     for path in sorted(files):
         result[path.removeprefix('src/')] = files[path]
     return result
 
 
+def _list_src_files(repo, ls_files=False):
+    try:
+        return _src_files(repo.ls_files('src') if ls_files else
+                          repo.ls_tree('src'))
+    except ExecuteError:
+        return {}
+
+
+def _version(arg):
+    if not VERSION_PAT.fullmatch(arg):
+        raise BadRequest()
+    return arg
+
+
+def _optional_version(args):
+    if args == ['']:
+        return [None]
+    if len(args) != 1:
+        raise BadRequest()
+    return [_version(args[0])]
+
+
+def _perm_version(args):
+    if len(args) not in (1, 2):
+        raise BadRequest()
+    perm = fullmatch(PERM_PAT)(args[0])
+    return [perm, *[_version(arg) for arg in args[1:]], None][:2]
+
+
+def _files_query(args):
+    if len(args) == 2:
+        return [int(args[0]), int(args[1]), None]
+    return [None, None, *_optional_version(args)]
+
+
+def _journal(repo):
+    return Journal(repo.path('.git/webui-journal'))
+
+
+def _changes(repo, journal, since):
+    version = journal.version()
+    paths = journal.since(since)
+    files = _list_src_files(repo, ls_files=True)
+    if paths is None:
+        return {'version': version, 'files': files}
+    changes = {}
+    for path in sorted(paths):
+        path = path.removeprefix('src/')
+        changes[path] = files.get(path)
+    return {'version': version, 'changes': changes}
+
+
+def _edited(repo, since, paths):
+    journal = _journal(repo)
+    journal.append(paths)
+    if since is None:
+        return _list_src_files(repo, ls_files=True)
+    return _changes(repo, journal, since)
+
+
+def _blob_id(repo, path):
+    oid = repo.blob_id(path)
+    if oid is None:
+        raise Forbidden(f'Error: {os.strerror(errno.ENOENT)}')
+    return oid
+
+
+def _prefetch(repo_dir):
+    git = GitServer(GIT_SERVER)
+    try:
+        with work_dir_lock(repo_dir):
+            repo = git.open(repo_dir)
+            url = repo.remote_url()
+            oids = repo.missing(repo.blob_ids('src'))
+        if url is None or not oids:
+            return
+        # fetch without the lock so pulls and edits are not held up
+        with tempfile.TemporaryDirectory(
+                '.tmp', '.', os.path.dirname(repo_dir)) as tmp:
+            staging = git.open(tmp)
+            staging.init(url)
+            staging.fetch_blobs(oids, 'background')
+            with work_dir_lock(repo_dir):
+                if os.path.isdir(repo_dir) and repo.remote_url() == url:
+                    repo.install_packs(staging)
+    except (ExecuteError, HTTPError, OSError):
+        pass
+
+
+def _snapshot(repo):
+    tree = repo.head_tree()
+    if tree is None:
+        return {'manifest': None, 'files': {}}
+    try:
+        return SNAPSHOTS.get(tree, lambda: {
+            'manifest': _get_manifest_json(repo),
+            'files': _src_files(repo.ls_tree('src'))
+        })
+    except ExecuteError:
+        return {'manifest': None, 'files': {}}
+
+
 def _check_owner(session, repo):
-    manifest = _get_manifest_json(repo)
+    manifest = _snapshot(repo)['manifest'] or {}
     webui = manifest.get('webui')
     if isinstance(webui, dict):
         owners = webui.get('owners')
@@ -154,78 +366,189 @@ def _check_owner(session, repo):
 def pull(req, res, flags, repo_name):
     with Session(req) as session:
         session.data.lock()
-        repo_dir = _repo_dir(session, must_exist=False, remove=True)
+        repo_dir = _repo_dir(session, must_exist=False)
         git = GitServer(GIT_SERVER)
         if 'e' in flags and repo_name not in git.info()['repos']:
             raise Forbidden('Repository not found')
-        repo = git.clone(repo_name, repo_dir)
+        result = None
+        with work_dir_lock(repo_dir):
+            if 'c' not in flags and os.path.isdir(repo_dir):
+                result = git.update(git.open(repo_dir), repo_name)
+            if result is None:
+                shutil.rmtree(repo_dir, ignore_errors=True)
+                repo = git.clone(repo_name, repo_dir)
+                result = 'clone'
+        stats.incr('pull_requests', result=result)
+        _journal(git.open(repo_dir)).reset()
         if 'c' in flags:
             if _get_revision(repo) is not None:
                 raise Forbidden('Repository exists')
             git.perms_plus(repo_name, 'WRITERS', session.data["user"])
-        return session.refresh(res)  # escalation
+        ret = session.refresh(res)  # escalation
+        threading.Thread(target=_prefetch, args=(_repo_dir(session),),
+                         daemon=True).start()
+        return {**ret, 'pull': result}
 
 
 @route('GET', '/api/repo')
 def repo_info(req, _res):
     with Session(req) as session:
-        repo = GitRepo(_repo_dir(session))
+        repo = GitServer(GIT_SERVER).open(_repo_dir(session))
         rev = _get_revision(repo)
-        manifest = _get_manifest_json(repo, none_if_error=True)
-        files = _list_src_files(repo)
-        return {'rev': rev, 'manifest': manifest, 'files': files}
+        return {'rev': rev, **_snapshot(repo)}
 
 
 @route('GET', f'/api/repo/({FILENAME_RE})')
 def get(req, res, file_name):
     with Session(req) as session:
         session.data.lock()
-        repo = GitRepo(_repo_dir(session))
-        if _get_revision(repo) is not None:
-            repo.sparse_checkout_add('src')
-            repo.checkout()
-        res.content_type = 'application/octet-stream'
-        with repo.chdir():
-            try:
-                path = os.path.join('src', file_name)
-                size = os.path.getsize(path)
-                if size > UPLOAD_SIZE_MAX:
-                    raise Forbidden('Content too large')
-                with open(path, 'rb') as file:
-                    return file.read()
-            except OSError as e:
-                raise Forbidden(f'Error: {str(e)}') from e
+        repo = GitServer(GIT_SERVER).open(_repo_dir(session))
+        repo.read_index()
+        oid = _blob_id(repo, os.path.join('src', file_name))
+        return send_file(req, res, repo.blob_file(oid), f'"{oid}"')
 
 
-@route('PUT', f'/api/repo/({FILENAME_RE})', [fullmatch(PERM_PAT)])
-def add(req, _res, file_name, perm):
+@route('PUT', f'/api/repo/({FILENAME_RE})', _perm_version)
+def add(req, _res, file_name, perm, since):
     mode = int(perm, 8)
     with Session(req) as session:
         session.data.lock()
-        repo = GitRepo(_repo_dir(session))
-        if _get_revision(repo) is not None:
-            repo.sparse_checkout_add('src')
-            repo.checkout()
+        repo = GitServer(GIT_SERVER).open(_repo_dir(session))
+        path = os.path.join('src', file_name)
         try:
-            repo.add(os.path.join('src', file_name), req.body, mode)
+            repo.write(path, req.body, mode)
         except OSError as e:
             raise Forbidden(f'Error: {str(e)}') from e
-        return _list_src_files(repo, ls_files=True)
+        repo.stage({path: mode})
+        return _edited(repo, since, [path])
+
+
+@route('DELETE', f'/api/repo/({FILENAME_RE})', _optional_version)
+def rm(req, _res, file_name, since):
+    with Session(req) as session:
+        session.data.lock()
+        repo = GitServer(GIT_SERVER).open(_repo_dir(session))
+        repo.read_index()
+        path = os.path.join('src', file_name)
+        _blob_id(repo, path)
+        repo.remove(path)
+        repo.stage({path: None})
+        return _edited(repo, since, [path])
 
 
-@route('DELETE', f'/api/repo/({FILENAME_RE})')
-def rm(req, _res, file_name):
+@route('GET', '/api/files', _files_query)
+def list_files(req, _res, first, count, since):
     with Session(req) as session:
         session.data.lock()
-        repo = GitRepo(_repo_dir(session))
-        if _get_revision(repo) is not None:
-            repo.sparse_checkout_add('src')
-            repo.checkout()
+        repo = GitServer(GIT_SERVER).open(_repo_dir(session))
+        repo.read_index()
+        journal = _journal(repo)
+        if since is not None:
+            return _changes(repo, journal, since)
+        version = journal.version()
+        files = _list_src_files(repo, ls_files=True)
+        first = 0 if first is None else max(first, 0)
+        count = len(files) if count is None else max(count, 0)
+        page = [*files.items()][first:first + count]
+        return {'version': version, 'total': len(files), 'files': dict(page)}
+
+
+def _stream(first, chunks):
+    yield first
+    yield from chunks
+
+
+@route('GET', f'/api/archive/(tar|zip)(?:/({FILENAME_RE}))?')
+def archive(req, res, archive_format, dir_name):
+    with Session(req) as session:
+        session.data.lock()
+        repo = GitServer(GIT_SERVER).open(_repo_dir(session))
+        path = 'src' if dir_name is None else os.path.join('src', dir_name)
         try:
-            repo.rm(os.path.join('src', file_name))
+            tree = repo.write_tree()
+            if not repo.ls_tree(path, tree):
+                raise Forbidden(f'Error: {os.strerror(errno.ENOENT)}')
+            repo.prefetch(path, tree)
+            chunks = repo.archive(tree, path, archive_format)
+            # a failure after this ends the chunked body without its last
+            # chunk, which clients report as a truncated download
+            first = next(chunks, b'')
+        except ExecuteError as e:
+            raise Forbidden(f'Error: {str(e)}') from e
+        name = os.path.basename(path)
+        res.content_type = ARCHIVE_TYPES[archive_format]
+        res.headers.append(('Content-Disposition',
+                            f'attachment; filename="{name}.{archive_format}"'))
+        res.headers.append(('Cache-Control', 'no-store'))
+        return _stream(first, chunks)
+
+
+def _batch_path(name):
+    name = name.removeprefix('./')
+    if not FILENAME_PAT.fullmatch(name) or '\n' in name:
+        raise BadRequest(f'Invalid path: {name}')
+    if any(item in ('.', '..') for item in name.split('/')):
+        raise BadRequest(f'Invalid path: {name}')
+    return os.path.join('src', name)
+
+
+def _whiteout(repo, changes, path, keep=()):
+    for item in [*repo.ls_files(path), *changes]:
+        if ((item == path or item.startswith(f'{path}/'))
+                and item not in keep):
+            repo.remove(item)
+            changes[item] = None
+    if not keep:
+        repo.remove(path)
+        changes.setdefault(path, None)
+
+
+def _extract_batch(repo, tar):
+    changes = {}
+    opaque = set()
+    total = 0
+    for member in tar:
+        if member.isdir():
+            continue
+        dir, base = os.path.split(member.name.removeprefix('./'))
+        if base == WHITEOUT_OPAQUE:
+            # drop what the directory held before this batch, at the end
+            opaque.add(_batch_path(dir) if dir else 'src')
+            continue
+        if base.startswith(WHITEOUT_PREFIX):
+            path = _batch_path(os.path.join(dir, base[len(WHITEOUT_PREFIX):]))
+            _whiteout(repo, changes, path)
+            continue
+        if not member.isfile():
+            raise BadRequest(f'Unsupported entry: {member.name}')
+        path = _batch_path(member.name)
+        total += member.size
+        if member.size > UPLOAD_SIZE_MAX or total > UPLOAD_BATCH_SIZE_MAX:
+            raise HTTPError('413 Large', 'content too large')
+        mode = 0o755 if member.mode & 0o111 else 0o644
+        repo.write(path, tar.extractfile(member), mode)
+        changes[path] = mode
+    written = {path for path, mode in changes.items() if mode is not None}
+    for path in opaque:
+        _whiteout(repo, changes, path, written)
+    return changes
+
+
+@route('PATCH', '/api/repo', _optional_version)
+def batch(req, _res, since):
+    with Session(req) as session:
+        session.data.lock()
+        repo = GitServer(GIT_SERVER).open(_repo_dir(session))
+        repo.read_index()
+        try:
+            with tarfile.open(fileobj=req.body, mode='r|*') as tar:
+                changes = _extract_batch(repo, tar)
+        except tarfile.TarError as e:
+            raise BadRequest() from e
         except OSError as e:
             raise Forbidden(f'Error: {str(e)}') from e
-        return _list_src_files(repo, ls_files=True)
+        repo.stage(changes)
+        return _edited(repo, since, [*changes])
 
 
 @route('POST', '/api/push')
@@ -233,14 +556,12 @@ def push(req, _res):
     with Session(req) as session:
         session.data.lock()
         repo_dir = _repo_dir(session)
-        repo = GitRepo(repo_dir)
+        git = GitServer(GIT_SERVER)
+        repo = git.open(repo_dir)
         _check_owner(session, repo)
         rev = _get_revision(repo)
-        if rev is not None:
-            repo.sparse_checkout_add('src')
-            repo.checkout()
         content = json.dumps(req.body, ensure_ascii=False, indent=2)
-        repo.add('manifest.json', content.encode('utf-8'))
+        repo.stage_blob('manifest.json', content)
         if repo.is_modified():
             verb = 'created' if rev is None else 'updated'
             repo.commit(f'{verb} by {session.data["user"]}', **WEBUI)
@@ -248,5 +569,7 @@ def push(req, _res):
                 repo.push()
             except ExecuteError as e:
                 raise Forbidden(f'Error: {str(e)}') from e
+            git.invalidate()
+            git.invalidate_mirror(repo)
         shutil.rmtree(repo_dir, ignore_errors=True)
         return {}
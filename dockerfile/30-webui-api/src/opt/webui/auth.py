@@ -1,7 +1,5 @@
-import PAM
-
-
 def _pam_conv(_auth, query_list, user_data):
+    import PAM  # pylint: disable=import-outside-toplevel
     result = []
     for query in query_list:
         if query[1] in (PAM.PAM_PROMPT_ECHO_ON, PAM.PAM_PROMPT_ECHO_OFF):
@@ -12,6 +10,7 @@ def _pam_conv(_auth, query_list, user_data):
 
 
 def authenticate(user, password):
+    import PAM  # pylint: disable=import-outside-toplevel
     try:
         auth = PAM.pam()
         auth.start('webui')
@@ -0,0 +1,124 @@
+import concurrent.futures
+import hashlib
+import hmac
+import os
+import threading
+import time
+import stats
+from response import ServiceUnavailable
+
+AUTH_WORKERS = int(os.environ.get('AUTH_WORKERS', '4'))
+AUTH_QUEUE_MAX = int(os.environ.get('AUTH_QUEUE_MAX', '64'))
+AUTH_TIMEOUT = int(os.environ.get('AUTH_TIMEOUT', '30'))
+AUTH_CACHE_TTL = int(os.environ.get('AUTH_CACHE_TTL', '300'))
+AUTH_CACHE_MAX = int(os.environ.get('AUTH_CACHE_MAX', '4096'))
+AUTH_SCRYPT_N = int(os.environ.get('AUTH_SCRYPT_N', '8192'))
+AUTH_RETRY_AFTER = 5
+_USER_LOCKS = 64
+
+
+def _scrypt(password, salt):
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=AUTH_SCRYPT_N,
+                          r=8, p=1, maxmem=256 * AUTH_SCRYPT_N * 8 + (1 << 20))
+
+
+class CredentialCache:
+    def __init__(self, ttl=AUTH_CACHE_TTL, size_max=AUTH_CACHE_MAX):
+        self._ttl = ttl
+        self._size_max = size_max
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def check(self, user, password):
+        with self._lock:
+            entry = self._entries.get(user)
+        if entry is None:
+            return False
+        salt, digest, expires = entry
+        if time.monotonic() >= expires:
+            self.invalidate(user)
+            return False
+        return hmac.compare_digest(_scrypt(password, salt), digest)
+
+    def store(self, user, password):
+        salt = os.urandom(16)
+        entry = (salt, _scrypt(password, salt), time.monotonic() + self._ttl)
+        with self._lock:
+            self._entries.pop(user, None)
+            self._entries[user] = entry
+            while len(self._entries) > self._size_max:
+                del self._entries[next(iter(self._entries))]
+
+    def invalidate(self, user):
+        with self._lock:
+            self._entries.pop(user, None)
+
+
+class AuthPool:
+    def __init__(self, backend, workers=AUTH_WORKERS,
+                 queue_max=AUTH_QUEUE_MAX, timeout=AUTH_TIMEOUT,
+                 cache=None):
+        self._backend = backend
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers,
+                                                               'auth')
+        self._queue_max = queue_max
+        self._timeout = timeout
+        self._cache = CredentialCache() if cache is None else cache
+        self._key = os.urandom(32)
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._user_locks = [threading.Lock() for _ in range(_USER_LOCKS)]
+
+    def _user_lock(self, user):
+        digest = hmac.digest(self._key, user.encode('utf-8'), 'sha256')
+        return self._user_locks[digest[0] % _USER_LOCKS]
+
+    def _verify(self, user, password, queued):
+        stats.observe('auth_queue_wait_seconds', time.monotonic() - queued)
+        with self._user_lock(user):
+            if self._cache.check(user, password):
+                stats.incr('auth_requests', result='cache')
+                return True
+            start = time.monotonic()
+            result = self._backend(user, password)
+            stats.incr('auth_backend_calls')
+            stats.incr('auth_backend_seconds', time.monotonic() - start)
+            if result:
+                self._cache.store(user, password)
+            else:
+                self._cache.invalidate(user)
+            stats.incr('auth_requests', result='ok' if result else 'failed')
+            return result
+
+    def _done(self, key, _future):
+        with self._lock:
+            self._pending.pop(key, None)
+        stats.gauge('auth_queue_depth', -1)
+
+    def authenticate(self, user, password):
+        if self._cache.check(user, password):
+            stats.incr('auth_requests', result='cache')
+            return True
+        key = (user, hmac.digest(self._key, password.encode('utf-8'),
+                                 'sha256'))
+        with self._lock:
+            future = self._pending.get(key)
+            submitted = future is None
+            if not submitted:
+                stats.incr('auth_requests', result='coalesced')
+            elif len(self._pending) >= self._queue_max:
+                stats.incr('auth_requests', result='rejected')
+                raise ServiceUnavailable('Too many login attempts',
+                                         AUTH_RETRY_AFTER)
+            else:
+                future = self._executor.submit(self._verify, user, password,
+                                               time.monotonic())
+                self._pending[key] = future
+                stats.gauge('auth_queue_depth')
+        if submitted:
+            future.add_done_callback(lambda f: self._done(key, f))
+        try:
+            return future.result(self._timeout)
+        except concurrent.futures.TimeoutError as e:
+            raise ServiceUnavailable('Authentication timed out',
+                                     AUTH_RETRY_AFTER) from e
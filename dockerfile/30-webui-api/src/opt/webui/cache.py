@@ -0,0 +1,145 @@
+import fcntl
+import json
+import os
+import tempfile
+import time
+import stats
+
+CACHE_DIR = os.environ.get('CACHE_DIR', 'cache')
+OBJECT_CACHE_SIZE_MAX = int(os.environ.get('OBJECT_CACHE_SIZE_MAX',
+                                           str(64 << 20)))
+OBJECT_CACHE_EVICT_INTERVAL = 64
+
+
+class TtlCache:
+    def __init__(self, name, cache_dir=CACHE_DIR):
+        self._name = name
+        self._dir = os.path.join(cache_dir, name)
+
+    def _invalidated(self):
+        try:
+            return os.stat(os.path.join(self._dir, '.invalidated')).st_mtime
+        except FileNotFoundError:
+            return 0
+
+    def _read(self, key):
+        try:
+            with open(os.path.join(self._dir, f'{key}.json'), 'rb') as file:
+                entry = json.load(file)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if entry['time'] < self._invalidated():
+            return None
+        return entry
+
+    def _write(self, key, entry):
+        fd, tmp = tempfile.mkstemp('.tmp', '.', self._dir)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump(entry, file, separators=(',', ':'))
+            os.replace(tmp, os.path.join(self._dir, f'{key}.json'))
+        except:
+            os.unlink(tmp)
+            raise
+
+    def _result(self, key, entry, result):
+        stats.incr('cache_requests', cache=self._name, key=key, result=result)
+        return entry['value']
+
+    def get(self, key, ttl, fetch):
+        entry = self._read(key)
+        if entry is not None and time.time() < entry['time'] + ttl:
+            return self._result(key, entry, 'hit')
+        os.makedirs(self._dir, exist_ok=True)
+        with open(os.path.join(self._dir, f'{key}.lock'), 'ab') as lock:
+            try:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if entry is not None:
+                    return self._result(key, entry, 'stale')
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            entry = self._read(key)
+            if entry is not None and time.time() < entry['time'] + ttl:
+                return self._result(key, entry, 'hit')
+            entry = {'time': time.time()}
+            entry['value'] = fetch()
+            self._write(key, entry)
+            return self._result(key, entry, 'miss')
+
+    def invalidate(self):
+        os.makedirs(self._dir, exist_ok=True)
+        marker = os.path.join(self._dir, '.invalidated')
+        with open(marker, 'ab'):
+            pass
+        os.utime(marker)
+
+
+class ObjectCache:
+    def __init__(self, name, size_max=OBJECT_CACHE_SIZE_MAX,
+                 cache_dir=CACHE_DIR):
+        self._name = name
+        self._dir = os.path.join(cache_dir, name)
+        self._size_max = size_max
+        self._writes = 0
+
+    def _path(self, key):
+        return os.path.join(self._dir, key[:2], f'{key[2:]}.json')
+
+    def _read(self, path):
+        try:
+            with open(path, 'rb') as file:
+                value = json.load(file)
+        except (OSError, json.JSONDecodeError):
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return value
+
+    def _write(self, path, value):
+        dir = os.path.dirname(path)
+        os.makedirs(dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp('.tmp', '.', dir)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump(value, file, separators=(',', ':'))
+            os.replace(tmp, path)
+        except:
+            os.unlink(tmp)
+            raise
+
+    def get(self, key, fetch):
+        path = self._path(key)
+        value = self._read(path)
+        if value is not None:
+            stats.incr('cache_requests', cache=self._name, result='hit')
+            return value['value']
+        value = {'value': fetch()}
+        self._write(path, value)
+        stats.incr('cache_requests', cache=self._name, result='miss')
+        self._writes += 1
+        if self._writes % OBJECT_CACHE_EVICT_INTERVAL == 1:
+            self._evict()
+        return value['value']
+
+    def _evict(self):
+        entries = []
+        for root, _dirs, files in os.walk(self._dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _mtime, size, _path in entries)
+        entries.sort()
+        while total > self._size_max and entries:
+            _mtime, size, path = entries.pop(0)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            stats.incr('cache_evictions', cache=self._name)
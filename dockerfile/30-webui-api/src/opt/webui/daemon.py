@@ -1,37 +1,88 @@
+import fcntl
+import importlib.util
+import json
+import os
 import random
+import tempfile
 import threading
+import time
+import traceback
+import stats
 from session import SESSION_TIMEOUT, reap_sessions
 
-try:
-    from pkg import apt_update
-except ModuleNotFoundError:
+if importlib.util.find_spec('apt') is None:
     from pkg_dummy import apt_update
+else:
+    from pkg import apt_update
+
+SCHEDULER_DIR = os.environ.get('SCHEDULER_DIR', 'scheduler')
+
+JOBS = {
+    'reaper': (reap_sessions, 10 * SESSION_TIMEOUT, 100 * SESSION_TIMEOUT),
+    'indexer': (apt_update, 259200, 1209600),
+}
+
+
+def _load_state(path):
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
 
-def _reaper_main():
-    reap_sessions()
-    _start_reaper()
+def _save_state(path, state):
+    fd, tmp = tempfile.mkstemp('.tmp', '.', os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump(state, file, indent=2)
+        os.replace(tmp, path)
+    except:
+        os.unlink(tmp)
+        raise
 
 
-def _start_reaper():
-    seconds = random.randrange(10, 100) * SESSION_TIMEOUT
-    t = threading.Timer(seconds, _reaper_main)
-    t.daemon = True
-    t.start()
+def _run(name, func):
+    start = time.time()
+    error = None
+    try:
+        func()
+    except Exception as e:
+        traceback.print_exc()
+        error = f'{type(e).__name__}: {e}'
+    duration = time.time() - start
+    stats.incr('scheduler_runs', job=name,
+               result='ok' if error is None else 'error')
+    stats.incr('scheduler_seconds', duration, job=name)
+    return {'last_run': start, 'duration': duration, 'error': error}
 
 
-def _indexer_main():
-    apt_update()
-    _start_indexer()
+def _schedule(job, now):
+    _func, low, high = JOBS[job]
+    return now + random.uniform(low, high)
 
 
-def _start_indexer():
-    seconds = random.randrange(259200, 1209600)
-    t = threading.Timer(seconds, _indexer_main)
-    t.daemon = True
-    t.start()
+def _main():
+    os.makedirs(SCHEDULER_DIR, exist_ok=True)
+    path = os.path.join(SCHEDULER_DIR, 'state.json')
+    with open(os.path.join(SCHEDULER_DIR, 'leader.lock'), 'ab') as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        state = _load_state(path)
+        state = {name: state.get(name, {}) for name in JOBS}
+        while True:
+            now = time.time()
+            for name, job in state.items():
+                if 'next_run' not in job:
+                    job['next_run'] = _schedule(name, now)
+                elif job['next_run'] <= now:
+                    job.update(_run(name, JOBS[name][0]))
+                    job['next_run'] = _schedule(name, time.time())
+            _save_state(path, state)
+            wait = min(job['next_run'] for job in state.values()) - time.time()
+            time.sleep(max(wait, 1))
 
 
 def start():
     random.seed()
-    _start_reaper()
-    _start_indexer()
+    stats.start()
+    threading.Thread(target=_main, name='scheduler', daemon=True).start()
@@ -1,8 +1,13 @@
 import urllib.parse
 import re
+import time
+import stats
 from response import BadRequest, HTTPError
 
 ROUTES = {}
+_META_PAT = re.compile(r'[\\.^$*+?{}\[\]|()]')
+_static = {}
+_dynamic = {}
 
 
 def identity(item):
@@ -23,30 +28,102 @@ def route(method, path, query_trans=None):
             ROUTES[path][1][method] = (query_trans, func)
         else:
             ROUTES[path] = (re.compile(path), {method: (query_trans, func)})
+            _compile()
         return func
     return _add_route
 
 
+def _compile():
+    static = {}
+    buckets = {}
+    for order, (path, (path_pat, methods)) in enumerate(ROUTES.items()):
+        meta = _META_PAT.search(path)
+        if meta is None:
+            static[path] = (order, 1, 1, methods, path)
+        else:
+            prefix = path[:path.rfind('/', 0, meta.start()) + 1]
+            buckets.setdefault(prefix, []).append(
+                (order, path, path_pat, methods)
+            )
+    dynamic = {}
+    for prefix, routes in buckets.items():
+        patterns = []
+        targets = {}
+        index = 1
+        for order, path, path_pat, methods in routes:
+            patterns.append(f'({path_pat.pattern})')
+            targets[index] = (order, index + 1, index + 1 + path_pat.groups,
+                              methods, path)
+            index += 1 + path_pat.groups
+        dynamic[prefix] = (re.compile('|'.join(patterns)), targets)
+    _static.clear()
+    _static.update(static)
+    _dynamic.clear()
+    _dynamic.update(dynamic)
+
+
+def _lookup(path):
+    found = _static.get(path)
+    path_match = None
+    pos = len(path)
+    while pos > 0:
+        pos = path.rfind('/', 0, pos)
+        if pos < 0:
+            break
+        bucket = _dynamic.get(path[:pos + 1])
+        if bucket is None:
+            continue
+        match = bucket[0].fullmatch(path)
+        if match:
+            target = bucket[1][match.lastindex]
+            if found is None or target[0] < found[0]:
+                found, path_match = target, match
+    return found, path_match
+
+
+def _query_args(query_trans, query):
+    if query_trans is None:
+        if query != '':
+            raise BadRequest()
+        return []
+    args = [*map(urllib.parse.unquote, query.split('&'))]
+    if callable(query_trans):
+        return query_trans(args)
+    if len(args) != len(query_trans):
+        raise BadRequest()
+    return [query_trans[i](args[i]) for i in range(len(args))]
+
+
+def _call(req, res, found, path_match):
+    if found is None:
+        raise HTTPError('404 Not Found')
+    _order, first, last, methods, _path = found
+    if req.method not in methods:
+        raise HTTPError('405 Method Not Allowed')
+    query_trans, func = methods[req.method]
+    try:
+        args = _query_args(query_trans, req.query)
+    except ValueError as e:
+        raise BadRequest() from e
+    groups = [path_match.group(i) for i in range(first, last)]
+    return func(req, res, *groups, *args)
+
+
 def dispatch(req, res):
-    for path_pat, methods in ROUTES.values():
-        path_match = path_pat.fullmatch(req.path)
-        if path_match:
-            if req.method not in methods:
-                raise HTTPError('405 Method Not Allowed')
-            query_trans, func = methods[req.method]
-            args = [*map(urllib.parse.unquote, req.query.split('&'))]
-            try:
-                if query_trans is None:
-                    if args != ['']:
-                        raise BadRequest()
-                    args = []
-                elif callable(query_trans):
-                    args = query_trans(args)
-                elif len(args) != len(query_trans):
-                    raise BadRequest()
-                else:
-                    args = [query_trans[i](args[i]) for i in range(len(args))]
-            except ValueError as e:
-                raise BadRequest() from e
-            return func(req, res, *path_match.groups(), *args)
-    raise HTTPError('404 Not Found')
+    start = time.monotonic()
+    found, path_match = _lookup(req.path)
+    status = '500'
+    try:
+        result = _call(req, res, found, path_match)
+        status = res.status.split()[0]
+        return result
+    except HTTPError as e:
+        status = e.response.status.split()[0]
+        raise
+    finally:
+        known = found is not None and req.method in found[3]
+        stats.observe('http_request_duration_seconds',
+                      time.monotonic() - start,
+                      method=req.method if known else 'other',
+                      route='unmatched' if found is None else found[4],
+                      status=status)
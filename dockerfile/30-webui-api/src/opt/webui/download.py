@@ -0,0 +1,81 @@
+import os
+import re
+from response import Forbidden, HTTPError
+
+_RANGE_PAT = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+class FileSlice:
+    def __init__(self, file, length):
+        self._file = file
+        self._remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+def _etag_match(header, etag):
+    if header is None:
+        return False
+    tags = [tag.strip().removeprefix('W/') for tag in header.split(',')]
+    return '*' in tags or etag in tags
+
+
+def _byte_range(header, size):
+    match = _RANGE_PAT.fullmatch(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start > end or start >= size:
+        error = HTTPError('416 Range Not Satisfiable', 'range not satisfiable')
+        error.response.headers.append(('Content-Range', f'bytes */{size}'))
+        raise error
+    return start, end
+
+
+def send_file(req, res, path, etag=None):
+    try:
+        file = open(path, 'rb')
+    except OSError as e:
+        raise Forbidden(f'Error: {e.strerror}') from e
+    try:
+        size = os.fstat(file.fileno()).st_size
+        res.content_type = 'application/octet-stream'
+        res.headers.append(('Accept-Ranges', 'bytes'))
+        res.headers.append(('Cache-Control', 'no-cache'))
+        if etag is not None:
+            res.headers.append(('ETag', etag))
+            if _etag_match(req.get_header('If-None-Match'), etag):
+                res.status = '304 Not Modified'
+                file.close()
+                return b''
+        header = req.get_header('Range')
+        if_range = req.get_header('If-Range')
+        span = None
+        if header is not None and if_range in (None, etag):
+            span = _byte_range(header, size)
+        if span is None:
+            res.headers.append(('Content-Length', str(size)))
+            return file
+        start, end = span
+        file.seek(start)
+        res.status = '206 Partial Content'
+        res.headers.append(('Content-Range', f'bytes {start}-{end}/{size}'))
+        res.headers.append(('Content-Length', str(end - start + 1)))
+        return FileSlice(file, end - start + 1)
+    except:
+        file.close()
+        raise
@@ -1,4 +1,11 @@
+import contextlib
+import os
 import subprocess
+import tempfile
+import time
+import stats
+
+STREAM_BLOCK_SIZE = 1 << 16
 
 
 class ExecuteError(Exception):
@@ -13,12 +20,45 @@ class ExecuteError(Exception):
         return f'Command exited with status {self.status}\n{self.stderr}'
 
 
-def execute(*command, env=None, timeout=10, cwd=None):
+def _label(command):
+    name = os.path.basename(command[0])
+    if name == 'git':
+        args = iter(command[1:])
+        for arg in args:
+            if arg in ('-c', '-C'):
+                next(args, None)
+            elif not arg.startswith('-'):
+                return f'git {arg}'
+    return name
+
+
+@contextlib.contextmanager
+def _measure(command, label):
+    label = label or _label(command)
+    start = time.monotonic()
+    result = 'ok'
+    try:
+        yield
+    except ExecuteError as e:
+        result = 'error' if e.status is not None else 'timeout'
+        raise
+    except GeneratorExit:
+        result = 'closed'
+        raise
+    finally:
+        if result == 'timeout':
+            stats.incr('subprocess_timeouts', command=label)
+        stats.observe('subprocess_duration_seconds', time.monotonic() - start,
+                      command=label, result=result)
+
+
+def _execute(command, env, timeout, cwd, input, stdout):
     try:
         result = subprocess.run(
             command,
-            stdin=subprocess.DEVNULL,
-            stdout=subprocess.PIPE,
+            **({'stdin': subprocess.DEVNULL} if input is None else
+               {'input': input}),
+            stdout=stdout,
             stderr=subprocess.PIPE,
             cwd=cwd,
             env=env,
@@ -32,3 +72,37 @@ def execute(*command, env=None, timeout=10, cwd=None):
     if result.returncode != 0:
         raise ExecuteError(command, result.returncode, result.stderr)
     return result.stdout
+
+
+def execute(*command, env=None, timeout=10, cwd=None, input=None,
+            stdout=subprocess.PIPE, label=None):
+    with _measure(command, label):
+        return _execute(command, env, timeout, cwd, input, stdout)
+
+
+def execute_stream(*command, env=None, cwd=None, label=None):
+    with _measure(command, label), tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(
+            command,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+            cwd=cwd,
+            env=env
+        )
+        try:
+            while True:
+                chunk = process.stdout.read(STREAM_BLOCK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+            process.wait()
+        finally:
+            if process.returncode is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+        if process.returncode != 0:
+            stderr.seek(0)
+            raise ExecuteError(command, process.returncode,
+                               stderr.read().decode('utf-8', 'replace'))
@@ -0,0 +1,19 @@
+import concurrent.futures
+import os
+
+FANOUT_MAX = int(os.environ.get('FANOUT_MAX', '4'))
+
+_EXECUTOR = concurrent.futures.ThreadPoolExecutor(FANOUT_MAX, 'fanout')
+
+
+def fanout(func, items):
+    futures = {_EXECUTOR.submit(func, item): item for item in items}
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                yield futures[future], None, e
+    finally:
+        for future in futures:
+            future.cancel()
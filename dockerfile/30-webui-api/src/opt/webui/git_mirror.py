@@ -0,0 +1,129 @@
+import contextlib
+import fcntl
+import os
+import shutil
+import tempfile
+import time
+import stats
+from execute import execute
+from session import SESSION_DIR
+
+# on the sessions volume, so local clones can hardlink mirror objects
+GIT_MIRROR_DIR = os.environ.get('GIT_MIRROR_DIR',
+                                os.path.join(SESSION_DIR, '.mirrors'))
+GIT_MIRROR_TTL = int(os.environ.get('GIT_MIRROR_TTL', '5'))
+GIT_MIRROR_SIZE_MAX = int(os.environ.get('GIT_MIRROR_SIZE_MAX',
+                                         str(1 << 30)))
+GIT_MIRROR_TIMEOUT = int(os.environ.get('GIT_MIRROR_TIMEOUT', '60'))
+_FETCHED = 'webui-fetched'
+
+
+def _disk_usage(path):
+    size = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except FileNotFoundError:
+                pass
+    return size
+
+
+class GitMirror:
+    def __init__(self, root, size_max=GIT_MIRROR_SIZE_MAX, ttl=GIT_MIRROR_TTL):
+        self._root = root
+        self._size_max = size_max
+        self._ttl = ttl
+
+    def path(self, repo_name):
+        return os.path.join(self._root, f'{repo_name}.git')
+
+    def _fetched(self, path):
+        try:
+            return os.stat(os.path.join(path, _FETCHED)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def _create(self, url, path, env):
+        parent = os.path.dirname(path)
+        tmp = tempfile.mkdtemp('.tmp', '.', parent)
+        try:
+            execute('git', 'clone', '--mirror', '--filter=blob:none', url,
+                    tmp, env=env, timeout=GIT_MIRROR_TIMEOUT)
+            os.rename(tmp, path)
+        except:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+    def _fresh(self, path):
+        fetched = self._fetched(path)
+        return fetched is not None and time.time() < fetched + self._ttl
+
+    def _update(self, repo_name, url, env):
+        path = self.path(repo_name)
+        if self._fresh(path):
+            stats.incr('git_mirror_requests', result='hit')
+            return False
+        fetched = self._fetched(path)
+        if fetched is None:
+            shutil.rmtree(path, ignore_errors=True)
+            self._create(url, path, env)
+            stats.incr('git_mirror_requests', result='miss')
+        else:
+            execute('git', 'fetch', '--prune', 'origin', cwd=path, env=env,
+                    timeout=GIT_MIRROR_TIMEOUT)
+            stats.incr('git_mirror_requests', result='fetch')
+        with open(os.path.join(path, _FETCHED), 'wb'):
+            pass
+        return True
+
+    @contextlib.contextmanager
+    def use(self, repo_name, url, env):
+        path = self.path(repo_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        updated = False
+        with open(f'{path}.lock', 'ab') as lock:
+            start = time.monotonic()
+            fcntl.flock(lock.fileno(), fcntl.LOCK_SH)
+            if not self._fresh(path):
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+                updated = self._update(repo_name, url, env)
+                fcntl.flock(lock.fileno(), fcntl.LOCK_SH)
+            else:
+                stats.incr('git_mirror_requests', result='hit')
+            stats.observe('git_mirror_lock_wait_seconds',
+                          time.monotonic() - start)
+            os.utime(lock.fileno())
+            yield path
+        if updated:
+            self._evict()
+
+    def invalidate(self, repo_name):
+        try:
+            os.utime(os.path.join(self.path(repo_name), _FETCHED), (0, 0))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        mirrors = []
+        for root, dirs, files in os.walk(self._root):
+            dirs[:] = [item for item in dirs if not item.endswith('.git')]
+            for name in files:
+                if name.endswith('.git.lock'):
+                    lock = os.path.join(root, name)
+                    path = lock.removesuffix('.lock')
+                    if os.path.isdir(path):
+                        mirrors.append((os.stat(lock).st_mtime, lock, path))
+        mirrors = [(used, lock, path, _disk_usage(path))
+                   for used, lock, path in sorted(mirrors, reverse=True)]
+        total = sum(size for *_rest, size in mirrors)
+        while total > self._size_max and len(mirrors) > 1:
+            _used, lock, path, size = mirrors.pop()
+            with open(lock, 'ab') as file:
+                try:
+                    fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            stats.incr('git_mirror_evictions')
@@ -0,0 +1,414 @@
+import collections
+import functools
+import glob
+import mmap
+import os
+import struct
+import zlib
+
+_TYPES = {1: 'commit', 2: 'tree', 3: 'blob', 4: 'tag'}
+_OFS_DELTA = 6
+_REF_DELTA = 7
+_IDX_MAGIC = b'\377tOc'
+_INFLATE_BLOCK = 64 << 10
+GIT_DELTA_BASE_CACHE_SIZE = int(os.environ.get('GIT_DELTA_BASE_CACHE_SIZE',
+                                               str(16 << 20)))
+
+
+class GitObjectError(Exception):
+    pass
+
+
+def _wrap(func):
+    @functools.wraps(func)
+    def _func(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except GitObjectError:
+            raise
+        except (OSError, ValueError, KeyError, IndexError, struct.error,
+                zlib.error) as e:
+            raise GitObjectError(str(e)) from e
+    return _func
+
+
+def _git_dir(work_dir):
+    path = os.path.join(work_dir, '.git')
+    if os.path.isfile(path):
+        with open(path, encoding='utf-8') as file:
+            path = file.read().removeprefix('gitdir:').strip()
+        path = os.path.join(work_dir, path)
+    return path
+
+
+def _varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+
+def _offset_varint(data, pos):
+    byte = data[pos]
+    pos += 1
+    value = byte & 0x7f
+    while byte & 0x80:
+        byte = data[pos]
+        pos += 1
+        value = ((value + 1) << 7) | (byte & 0x7f)
+    return value, pos
+
+
+def _inflate(data, pos, size):
+    # bounded input slices: a whole-pack slice makes zlib copy the rest of
+    # the pack into unused_data on every read
+    decompressor = zlib.decompressobj()
+    chunks = []
+    length = 0
+    view = memoryview(data)
+    while not decompressor.eof and length <= size:
+        block = decompressor.unconsumed_tail
+        if not block:
+            block = view[pos:pos + _INFLATE_BLOCK]
+            if not block:
+                break
+            pos += len(block)
+        chunk = decompressor.decompress(block, size + 1 - length)
+        chunks.append(chunk)
+        length += len(chunk)
+    if length != size or not decompressor.eof:
+        raise GitObjectError('truncated pack entry')
+    return b''.join(chunks)
+
+
+def _apply_delta(base, delta):
+    src_size, pos = _varint(delta, 0)
+    dst_size, pos = _varint(delta, pos)
+    if src_size != len(base):
+        raise GitObjectError('delta base size mismatch')
+    result = bytearray()
+    while pos < len(delta):
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            offset = size = 0
+            for i in range(4):
+                if op & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if op & (0x10 << i):
+                    size |= delta[pos] << (8 * i)
+                    pos += 1
+            result += base[offset:offset + (size or 0x10000)]
+        elif op:
+            result += delta[pos:pos + op]
+            pos += op
+        else:
+            raise GitObjectError('invalid delta opcode')
+    if len(result) != dst_size:
+        raise GitObjectError('delta result size mismatch')
+    return bytes(result)
+
+
+class _Pack:
+    def __init__(self, idx_path):
+        with open(idx_path, 'rb') as file:
+            self._idx = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._idx[0:4] != _IDX_MAGIC or self._idx[4:8] != b'\0\0\0\2':
+            raise GitObjectError(f'{idx_path}: unsupported pack index')
+        self._fanout = struct.unpack_from('>256I', self._idx, 8)
+        self._count = self._fanout[255]
+        self._pack_path = idx_path.removesuffix('.idx') + '.pack'
+        self._pack = None
+        self._bases = collections.OrderedDict()
+        self._bases_size = 0
+
+    def _base(self, offset, store):
+        base = self._bases.get(offset)
+        if base is not None:
+            self._bases.move_to_end(offset)
+            return base
+        base = self.read(offset, store)
+        self._bases[offset] = base
+        self._bases_size += len(base[1])
+        while self._bases_size > GIT_DELTA_BASE_CACHE_SIZE and self._bases:
+            _offset, (_kind, data) = self._bases.popitem(last=False)
+            self._bases_size -= len(data)
+        return base
+
+    def _find(self, oid):
+        lo = self._fanout[oid[0] - 1] if oid[0] else 0
+        hi = self._fanout[oid[0]]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = 1032 + 20 * mid
+            item = self._idx[pos:pos + 20]
+            if item < oid:
+                lo = mid + 1
+            elif item > oid:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def offset(self, oid):
+        i = self._find(oid)
+        if i is None:
+            return None
+        pos = 1032 + 24 * self._count + 4 * i
+        offset, = struct.unpack_from('>I', self._idx, pos)
+        if offset & 0x80000000:
+            pos = 1032 + 28 * self._count + 8 * (offset & 0x7fffffff)
+            offset, = struct.unpack_from('>Q', self._idx, pos)
+        return offset
+
+    def read(self, offset, store):
+        if self._pack is None:
+            with open(self._pack_path, 'rb') as file:
+                self._pack = mmap.mmap(file.fileno(), 0,
+                                       access=mmap.ACCESS_READ)
+        byte = self._pack[offset]
+        kind = (byte >> 4) & 7
+        size = byte & 0x0f
+        pos = offset + 1
+        shift = 4
+        while byte & 0x80:
+            byte = self._pack[pos]
+            pos += 1
+            size |= (byte & 0x7f) << shift
+            shift += 7
+        if kind == _OFS_DELTA:
+            distance, pos = _offset_varint(self._pack, pos)
+            base_kind, base = self._base(offset - distance, store)
+        elif kind == _REF_DELTA:
+            base_kind, base = store.read(self._pack[pos:pos + 20])
+            pos += 20
+        data = _inflate(self._pack, pos, size)
+        if kind in (_OFS_DELTA, _REF_DELTA):
+            return base_kind, _apply_delta(base, data)
+        return _TYPES[kind], data
+
+
+class ObjectStore:
+    def __init__(self, work_dir):
+        self.git_dir = _git_dir(work_dir)
+        self._object_dirs = []
+        self._add_object_dir(os.path.join(self.git_dir, 'objects'))
+        self._packs = None
+
+    def _add_object_dir(self, path):
+        path = os.path.normpath(path)
+        if path in self._object_dirs:
+            return
+        self._object_dirs.append(path)
+        try:
+            with open(os.path.join(path, 'info', 'alternates'),
+                      encoding='utf-8') as file:
+                alternates = file.read().splitlines()
+        except FileNotFoundError:
+            return
+        for alternate in alternates:
+            if alternate and not alternate.startswith('#'):
+                self._add_object_dir(os.path.join(path, alternate))
+
+    def _load_packs(self):
+        self._packs = []
+        for path in self._object_dirs:
+            pattern = os.path.join(path, 'pack', '*.idx')
+            for idx_path in sorted(glob.glob(pattern)):
+                self._packs.append(_Pack(idx_path))
+
+    def _read_loose(self, oid):
+        name = oid.hex()
+        for path in self._object_dirs:
+            try:
+                with open(os.path.join(path, name[:2], name[2:]),
+                          'rb') as file:
+                    data = zlib.decompress(file.read())
+            except FileNotFoundError:
+                continue
+            header, data = data.split(b'\0', 1)
+            kind, size = header.decode('ascii').split(' ')
+            if int(size) != len(data):
+                raise GitObjectError(f'{name}: corrupt loose object')
+            return kind, data
+        return None
+
+    def _read_packed(self, oid):
+        for pack in self._packs:
+            offset = pack.offset(oid)
+            if offset is not None:
+                return pack.read(offset, self)
+        return None
+
+    @_wrap
+    def read(self, oid):
+        if isinstance(oid, str):
+            oid = bytes.fromhex(oid)
+        if self._packs is None:
+            self._load_packs()
+        result = self._read_packed(oid) or self._read_loose(oid)
+        if result is None:
+            self._load_packs()
+            result = self._read_packed(oid)
+        if result is None:
+            raise GitObjectError(f'{oid.hex()}: object not found')
+        return result
+
+    @_wrap
+    def contains(self, oid):
+        if isinstance(oid, str):
+            oid = bytes.fromhex(oid)
+        name = oid.hex()
+        for path in self._object_dirs:
+            if os.path.exists(os.path.join(path, name[:2], name[2:])):
+                return True
+        for reload in (self._packs is None, True):
+            if reload:
+                self._load_packs()
+            if any(pack.offset(oid) is not None for pack in self._packs):
+                return True
+        return False
+
+    def has(self, oid):
+        try:
+            self.read(oid)
+            return True
+        except GitObjectError:
+            return False
+
+    def _read_ref(self, ref):
+        try:
+            with open(os.path.join(self.git_dir, ref),
+                      encoding='utf-8') as file:
+                return file.read().strip()
+        except (FileNotFoundError, IsADirectoryError):
+            pass
+        try:
+            with open(os.path.join(self.git_dir, 'packed-refs'),
+                      encoding='utf-8') as file:
+                for line in file:
+                    if line.rstrip('\n').endswith(f' {ref}'):
+                        return line.split(' ', 1)[0]
+        except FileNotFoundError:
+            pass
+        raise GitObjectError(f'{ref}: unknown revision')
+
+    @_wrap
+    def resolve(self, ref='HEAD'):
+        for _ in range(8):
+            value = self._read_ref(ref)
+            if not value.startswith('ref: '):
+                bytes.fromhex(value)
+                if len(value) != 40:
+                    raise GitObjectError(f'{ref}: unsupported object format')
+                return value
+            ref = value.removeprefix('ref: ')
+        raise GitObjectError(f'{ref}: too many levels of symbolic refs')
+
+    def _expect(self, oid, kind):
+        actual, data = self.read(oid)
+        if actual != kind:
+            raise GitObjectError(f'{oid}: expected {kind}, got {actual}')
+        return data
+
+    def _tree_entries(self, oid):
+        data = self._expect(oid, 'tree')
+        pos = 0
+        while pos < len(data):
+            space = data.index(b' ', pos)
+            nul = data.index(b'\0', space)
+            mode = int(data[pos:space], 8)
+            name = data[space + 1:nul].decode('utf-8', 'surrogateescape')
+            yield name, mode, data[nul + 1:nul + 21]
+            pos = nul + 21
+
+    @_wrap
+    def tree(self, rev):
+        for line in self._expect(rev, 'commit').split(b'\n'):
+            if line.startswith(b'tree '):
+                return line[5:].decode('ascii')
+        raise GitObjectError(f'{rev}: commit without tree')
+
+    def _lookup(self, tree, path):
+        mode, oid = 0o40000, bytes.fromhex(tree)
+        for name in path.split('/'):
+            if mode != 0o40000:
+                return None
+            for entry, entry_mode, entry_oid in self._tree_entries(oid):
+                if entry == name:
+                    mode, oid = entry_mode, entry_oid
+                    break
+            else:
+                return None
+        return mode, oid
+
+    @_wrap
+    def blob(self, tree, path):
+        found = self._lookup(tree, path)
+        if found is None:
+            raise GitObjectError(f'{path}: no such path in tree')
+        return self._expect(found[1], 'blob')
+
+    @_wrap
+    def ls_tree(self, tree, path):
+        found = self._lookup(tree, path)
+        if found is None:
+            return {}
+        mode, oid = found
+        if mode != 0o40000:
+            return {path: (mode, oid.hex())}
+        result = {}
+        stack = [(path, oid)]
+        while stack:
+            prefix, oid = stack.pop()
+            for name, mode, entry_oid in self._tree_entries(oid):
+                if mode == 0o40000:
+                    stack.append((f'{prefix}/{name}', entry_oid))
+                else:
+                    result[f'{prefix}/{name}'] = (mode, entry_oid.hex())
+        return result
+
+    @_wrap
+    def ls_files(self, path):
+        with open(os.path.join(self.git_dir, 'index'), 'rb') as file:
+            data = file.read()
+        signature, version, count = struct.unpack_from('>4sII', data)
+        if signature != b'DIRC' or version not in (2, 3, 4):
+            raise GitObjectError('unsupported index format')
+        result = {}
+        pos = 12
+        name = b''
+        for _ in range(count):
+            start = pos
+            mode, = struct.unpack_from('>I', data, pos + 24)
+            oid = data[pos + 40:pos + 60]
+            flags, = struct.unpack_from('>H', data, pos + 60)
+            pos += 62
+            if version >= 3 and flags & 0x4000:
+                pos += 2
+            if version == 4:
+                strip, pos = _offset_varint(data, pos)
+                nul = data.index(b'\0', pos)
+                name = name[:len(name) - strip] + data[pos:nul]
+                pos = nul + 1
+            else:
+                nul = data.index(b'\0', pos)
+                name = data[pos:nul]
+                pos = start + ((nul - start + 8) & ~7)
+            if mode == 0o40000:
+                raise GitObjectError('sparse index is not supported')
+            entry = name.decode('utf-8', 'surrogateescape')
+            if entry == path or entry.startswith(f'{path}/'):
+                result[entry] = (mode, oid.hex())
+        while pos + 8 <= len(data) - 20:
+            extension, size = struct.unpack_from('>4sI', data, pos)
+            if extension in (b'link', b'sdir'):
+                raise GitObjectError('split or sparse index is not supported')
+            pos += 8 + size
+        return result
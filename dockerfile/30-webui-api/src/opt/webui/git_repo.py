@@ -1,6 +1,52 @@
+import contextlib
+import fcntl
 import os
-from execute import execute, ExecuteError
-from chdir import Chdir
+import shutil
+import tempfile
+import stats
+from admission import admit
+from execute import execute, execute_stream, ExecuteError
+from git_object import GitObjectError, ObjectStore
+
+
+_NULL_OID = '0' * 40
+COPY_BUFSIZE = 1 << 20
+GIT_PREFETCH_TIMEOUT = int(os.environ.get('GIT_PREFETCH_TIMEOUT', '300'))
+GIT_BLOB_CACHE_SIZE_MAX = int(os.environ.get('GIT_BLOB_CACHE_SIZE_MAX',
+                                             str(64 << 20)))
+_BLOB_CACHE = 'webui-blobs'
+# background prefetch has its own queue so it never delays user pulls
+_FETCH_ADMISSION = {'single': 'read', 'prefetch': 'clone',
+                    'background': 'prefetch'}
+
+
+@contextlib.contextmanager
+def work_dir_lock(work_dir):
+    with open(f'{work_dir}.lock', 'ab') as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        yield
+
+
+def _evict_blobs(cache_dir, keep, size_max):
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.startswith('.') or path == keep:
+            continue
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = os.stat(keep).st_size + sum(size for _, size, _ in entries)
+    for _mtime, size, path in sorted(entries):
+        if total <= size_max:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
 
 
 def _parse_file_list(stdout):
@@ -12,58 +58,266 @@ def _parse_file_list(stdout):
     return result
 
 
+def _file_modes(entries):
+    return {path: mode & 0o777 for path, (mode, _oid) in entries.items()}
+
+
+def _blob_mode(mode):
+    return '100755' if mode & 0o111 else '100644'
+
+
 class GitRepo:
-    def __init__(self, work_dir):
+    def __init__(self, work_dir, env=None, native=True):
         self._dir = work_dir
+        self._env = env or {}
+        self._objects = ObjectStore(work_dir) if native else None
+        self._head = None
+
+    def path(self, path):
+        return os.path.join(self._dir, path)
 
-    def chdir(self):
-        return Chdir(self._dir)
+    def _command_env(self, env):
+        base = self._env() if callable(self._env) else self._env
+        env = {**base, **(env or {})}
+        return {**os.environ, **env} if env else None
+
+    def execute(self, *command, env=None, input=None, **kwargs):
+        return execute(
+            'git', *command,
+            cwd=self._dir,
+            env=self._command_env(env),
+            input=input,
+            **kwargs
+        )
+
+    def execute_stream(self, *command, env=None):
+        return execute_stream('git', *command, cwd=self._dir,
+                              env=self._command_env(env))
+
+    def _native(self, func):
+        if self._objects is None:
+            return None
+        try:
+            return func()
+        except GitObjectError:
+            return None
+
+    def _head_tree(self):
+        if self._head is None:
+            rev = self._objects.resolve()
+            self._head = (rev, self._objects.tree(rev))
+        return self._head[1]
 
     def rev_parse(self):
-        return execute('git', 'rev-parse', 'HEAD', '--', cwd=self._dir).strip()
+        rev = self._native(lambda: self._objects.resolve())
+        if rev is not None:
+            return rev
+        return self.execute('rev-parse', 'HEAD', '--').split('\n', 1)[0]
+
+    def rev_parse_or_none(self):
+        try:
+            return self.rev_parse()
+        except ExecuteError:
+            return None
+
+    def head_tree(self):
+        tree = self._native(self._head_tree)
+        if tree is not None:
+            return tree
+        try:
+            return self.execute('rev-parse', 'HEAD^{tree}').strip()
+        except ExecuteError:
+            return None
 
     def cat_file(self, path):
-        return execute('git', 'cat-file', '-p', f'HEAD:{path}', cwd=self._dir)
+        content = self._native(
+            lambda: self._objects.blob(self._head_tree(), path)
+        )
+        if content is not None:
+            try:
+                return content.decode('utf-8')
+            except UnicodeDecodeError:
+                pass
+        return self.execute('cat-file', '-p', f'HEAD:{path}')
 
-    def ls_tree(self, path):
-        stdout = execute(
-            'git', 'ls-tree', '-r', '-z', '--format=%(objectmode) %(path)',
-            'HEAD', path,
-            cwd=self._dir
+    def ls_tree(self, path, tree=None):
+        entries = self._native(
+            lambda: self._objects.ls_tree(tree or self._head_tree(), path)
+        )
+        if entries is not None:
+            return _file_modes(entries)
+        stdout = self.execute(
+            'ls-tree', '-r', '-z', '--format=%(objectmode) %(path)',
+            tree or 'HEAD', path
         )
         return _parse_file_list(stdout)
 
     def ls_files(self, path):
-        stdout = execute(
-            'git', 'ls-files', '-z', '--format=%(objectmode) %(path)', path,
-            cwd=self._dir
+        entries = self._native(lambda: self._objects.ls_files(path))
+        if entries is not None:
+            return _file_modes(entries)
+        stdout = self.execute(
+            'ls-files', '-z', '--format=%(objectmode) %(path)', path
         )
         return _parse_file_list(stdout)
 
-    def sparse_checkout_add(self, *paths):
-        execute('git', 'sparse-checkout', 'add', *paths, cwd=self._dir)
+    def blob_id(self, path):
+        entries = self._native(lambda: self._objects.ls_files(path))
+        if entries is not None:
+            entry = entries.get(path)
+            return None if entry is None else entry[1]
+        stdout = self.execute('ls-files', '-z', '--format=%(objectname)',
+                              '--', path)
+        return stdout.split('\0', 1)[0] or None
+
+    def _git_dir(self):
+        return os.path.join(self._dir, '.git')
+
+    def missing(self, oids):
+        if self._objects is None:
+            return oids
+        return [oid for oid in oids
+                if not self._native(lambda oid=oid:
+                                    self._objects.contains(oid))]
 
-    def checkout(self):
-        execute('git', 'checkout', '-q', cwd=self._dir)
+    def fetch_blobs(self, oids, kind, timeout=GIT_PREFETCH_TIMEOUT):
+        oids = self.missing(oids)
+        if not oids:
+            return 0
+        with admit(_FETCH_ADMISSION[kind]):
+            self.execute(
+                '-c', 'fetch.negotiationAlgorithm=noop',
+                'fetch', '-q', '--no-tags', '--no-write-fetch-head',
+                '--recurse-submodules=no', '--filter=blob:none', '--stdin',
+                'origin',
+                input=''.join(f'{oid}\n' for oid in oids),
+                timeout=timeout
+            )
+        stats.incr('blob_fetches', kind=kind)
+        stats.incr('blob_fetch_objects', len(oids), kind=kind)
+        return len(oids)
 
-    def add(self, path, content, mode=0o644):
-        with self.chdir():
-            dir = os.path.dirname(path)
-            if dir:
-                os.makedirs(dir, exist_ok=True)
-            with open(path, 'wb') as file:
-                file.write(content)
-            os.chmod(path, mode)
-            execute('git', 'add', path)
+    def blob_ids(self, path, tree=None):
+        if tree is None:
+            tree = self._native(self._head_tree) or 'HEAD'
+        entries = self._native(lambda: self._objects.ls_tree(tree, path))
+        if entries is None:
+            stdout = self.execute('ls-tree', '-r', '-z',
+                                  '--format=%(objectname)', tree, path)
+            return [oid for oid in stdout.split('\0') if oid]
+        return [oid for _mode, oid in entries.values()]
 
-    def rm(self, path):
-        with self.chdir():
+    def prefetch(self, path, tree=None):
+        return self.fetch_blobs(self.blob_ids(path, tree), 'prefetch')
+
+    def init(self, url):
+        self.execute('init', '-q')
+        self.execute('remote', 'add', 'origin', url)
+
+    def install_packs(self, source):
+        source_dir = os.path.join(source._git_dir(), 'objects', 'pack')
+        pack_dir = os.path.join(self._git_dir(), 'objects', 'pack')
+        os.makedirs(pack_dir, exist_ok=True)
+        # git finds packs through their .idx, so it goes in last
+        for name in sorted(os.listdir(source_dir),
+                           key=lambda name: name.endswith('.idx')):
+            os.replace(os.path.join(source_dir, name),
+                       os.path.join(pack_dir, name))
+
+    def write_tree(self):
+        self.read_index()
+        return self.execute('write-tree', '--missing-ok').strip()
+
+    def archive(self, tree, path, archive_format):
+        return self.execute_stream('archive', f'--format={archive_format}',
+                                   f'{tree}:{path}')
+
+    def blob_file(self, oid):
+        cache_dir = os.path.join(self._git_dir(), _BLOB_CACHE)
+        path = os.path.join(cache_dir, oid)
+        try:
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+        self.fetch_blobs([oid], 'single')
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp('.tmp', '.', cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                self.execute('cat-file', 'blob', oid, stdout=file,
+                             timeout=GIT_PREFETCH_TIMEOUT)
+            os.replace(tmp, path)
+        except:
+            os.unlink(tmp)
+            raise
+        _evict_blobs(cache_dir, path, GIT_BLOB_CACHE_SIZE_MAX)
+        return path
+
+    def write(self, path, content, mode=0o644):
+        path = os.path.join(self._dir, path)
+        dir = os.path.dirname(path)
+        os.makedirs(dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp('.tmp', '.', dir)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                if isinstance(content, bytes):
+                    file.write(content)
+                else:
+                    shutil.copyfileobj(content, file, COPY_BUFSIZE)
+            os.chmod(tmp, mode)
+            os.replace(tmp, path)
+        except:
+            os.unlink(tmp)
+            raise
+
+    def remove(self, path):
+        path = os.path.join(self._dir, path)
+        try:
             os.remove(path)
-            execute('git', 'add', path)
+        except FileNotFoundError:
+            pass
+        except IsADirectoryError:
+            shutil.rmtree(path)
+
+    def _update_index(self, entries):
+        self.execute('update-index', '-z', '--index-info',
+                     input=''.join(f'{mode} {oid}\t{path}\0'
+                                   for mode, oid, path in entries))
+
+    def read_index(self):
+        if os.path.exists(os.path.join(self._git_dir(), 'index')):
+            return
+        if self.rev_parse_or_none() is not None:
+            self.execute('read-tree', 'HEAD')
+
+    def stage(self, changes):
+        self.read_index()
+        added = [path for path, mode in changes.items() if mode is not None]
+        oids = []
+        if added:
+            stdout = self.execute(
+                'hash-object', '-w', '--stdin-paths',
+                input=''.join(f'{path}\n' for path in added)
+            )
+            oids = stdout.split()
+        entries = []
+        for path, oid in zip(added, oids):
+            entries.append((_blob_mode(changes[path]), oid, path))
+        for path, mode in changes.items():
+            if mode is None:
+                entries.append(('0', _NULL_OID, path))
+        if entries:
+            self._update_index(entries)
+
+    def stage_blob(self, path, content, mode=0o644):
+        self.read_index()
+        oid = self.execute('hash-object', '-w', '--stdin', input=content)
+        self._update_index([(_blob_mode(mode), oid.strip(), path)])
 
     def is_modified(self):
         try:
-            execute('git', 'diff', '--quiet', '--cached', cwd=self._dir)
+            self.execute('diff', '--quiet', '--cached')
             return False
         except ExecuteError as e:
             if e.status != 1:
@@ -71,16 +325,49 @@ class GitRepo:
             return True
 
     def commit(self, message, user, email):
-        execute(
-            'git', 'commit', '-m', message,
-            cwd=self._dir,
+        parent = self.rev_parse_or_none()
+        tree = self.write_tree()
+        rev = self.execute(
+            'commit-tree', tree, *([] if parent is None else ['-p', parent]),
+            '-m', message,
             env={
                 'GIT_AUTHOR_NAME': user,
                 'GIT_AUTHOR_EMAIL': email,
                 'GIT_COMMITTER_NAME': user,
                 'GIT_COMMITTER_EMAIL': email
             }
-        )
+        ).strip()
+        self.execute('update-ref', '-m', message, 'HEAD', rev,
+                     _NULL_OID if parent is None else parent)
+        self._head = None
+        return rev
+
+    def fetch(self):
+        # not --depth=1: that cuts new HEAD's parents and is_ancestor always
+        # fails; negotiation already limits this to commits since our HEAD
+        self.execute('fetch', '-q', '--no-tags', 'origin', 'HEAD')
+        return self.execute('rev-parse', 'FETCH_HEAD').strip()
+
+    def is_ancestor(self, ancestor, rev):
+        try:
+            self.execute('merge-base', '--is-ancestor', ancestor, rev)
+            return True
+        except ExecuteError as e:
+            if e.status != 1:
+                raise
+            return False
+
+    def reset(self, rev):
+        self._head = None
+        self.execute('reset', '-q', '--hard', rev)
+        self.execute('clean', '-q', '-d', '-f')
+
+    def remote_url(self):
+        try:
+            return self.execute('config', '--get', 'remote.origin.url').strip()
+        except ExecuteError:
+            return None
 
     def push(self):
-        execute('git', 'push', '-q', cwd=self._dir)
+        with admit('push'):
+            self.execute('push', '-q')
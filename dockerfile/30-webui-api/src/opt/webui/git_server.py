@@ -1,23 +1,53 @@
 import json
-from execute import execute
+import os
+from admission import admit
+from cache import TtlCache
+from execute import execute, ExecuteError
+from git_mirror import GIT_MIRROR_DIR, GitMirror
 from git_repo import GitRepo
+from ssh_pool import SSH_POOL
+
+INFO_CACHE_TTL = int(os.environ.get('INFO_CACHE_TTL', '30'))
+FLAVORS_CACHE_TTL = int(os.environ.get('FLAVORS_CACHE_TTL', '60'))
 
 
 class GitServer:
-    def __init__(self, server='localhost'):
+    def __init__(self, server='localhost', pool=SSH_POOL):
         self.server = server
+        self._pool = pool
+        self._cache = TtlCache(f'gitolite-{server}')
+        self._mirror = (GitMirror(os.path.join(GIT_MIRROR_DIR, server))
+                        if GIT_MIRROR_DIR else None)
+
+    def _destination(self):
+        return f'git@{self.server}'
+
+    def ssh(self, *subcommand, idempotent=True, kind='read', wait=None):
+        with admit(kind, wait):
+            return self._pool.run(self._destination(), *subcommand,
+                                  idempotent=idempotent)
+
+    def open(self, work_dir):
+        return GitRepo(work_dir, env=self._git_env)
 
-    def ssh(self, *subcommand):
-        return execute('ssh', f'git@{self.server}', *subcommand)
+    def _git_env(self):
+        return self._pool.git_env(self._destination())
+
+    def invalidate(self):
+        self._cache.invalidate()
 
     def info(self):
-        return json.loads(self.ssh('info', '-p', '--json'))
+        return self._cache.get(
+            'info', INFO_CACHE_TTL,
+            lambda: json.loads(self.ssh('info', '-p', '--json'))
+        )
 
     def perms_plus(self, repo_name, role_name, user):
-        self.ssh('perms', repo_name, '+', role_name, user)
+        self.ssh('perms', repo_name, '+', role_name, user, idempotent=False)
+        self.invalidate()
 
-    def job_status(self, repo_name):
-        stdout = self.ssh('job-status', '-h', repo_name)
+    def job_status(self, repo_name, kind='read', wait=None):
+        stdout = self.ssh('job-status', '-h', repo_name, kind=kind, wait=wait)
         result = {}
         for line in stdout.splitlines():
             try:
@@ -27,24 +57,74 @@ class GitServer:
                 pass
         return result
 
-    def job_log(self, repo_name):
-        return self.ssh('job-status', repo_name)
+    def job_log(self, repo_name, wait=None):
+        return self.ssh('job-status', repo_name, wait=wait)
 
-    def login_log(self, repo_name, count=None):
+    def login_log(self, repo_name, count=None, kind='read'):
         stdout = self.ssh(
             'login-log',
             *([] if count is None else ['-n', str(count)]),
-            repo_name
+            repo_name,
+            kind=kind
         )
         return [json.loads(line) for line in stdout.splitlines()]
 
     def flavors_available(self):
-        return json.loads(self.ssh('adm', 'webui', 'flavors-available'))
+        return self._cache.get(
+            'flavors-available', FLAVORS_CACHE_TTL,
+            lambda: json.loads(self.ssh('adm', 'webui', 'flavors-available'))
+        )
+
+    def _url(self, repo_name):
+        return f'{self._destination()}:{repo_name}'
 
     def clone(self, repo_name, work_dir):
-        execute(
-            'git', 'clone', '--depth=1', '--no-checkout', '--sparse',
-            '--filter=blob:none',
-            f'git@{self.server}:{repo_name}', work_dir
-        )
-        return GitRepo(work_dir)
+        with admit('clone'):
+            return self._clone(repo_name, work_dir)
+
+    def _clone(self, repo_name, work_dir):
+        env = self._git_env()
+        url = self._url(repo_name)
+        if self._mirror is None:
+            execute(
+                'git', 'clone', '--depth=1', '--no-checkout', '--sparse',
+                '--filter=blob:none', url, work_dir,
+                env={**os.environ, **env}
+            )
+            return GitRepo(work_dir, env=env)
+        with self._mirror.use(repo_name, url, {**os.environ, **env}) as path:
+            execute('git', 'clone', '--no-checkout', '--sparse', path,
+                    work_dir)
+        repo = GitRepo(work_dir, env=env)
+        repo.execute('remote', 'set-url', 'origin', url)
+        repo.execute('config', 'remote.origin.promisor', 'true')
+        repo.execute('config', 'remote.origin.partialclonefilter', 'blob:none')
+        repo.execute('config', 'extensions.partialclone', 'origin')
+        return repo
+
+    def update(self, repo, repo_name):
+        if self.repo_name(repo) != repo_name:
+            return None
+        try:
+            rev = repo.rev_parse()
+            with admit('clone'):
+                new_rev = repo.fetch()
+            if not repo.is_ancestor(rev, new_rev):
+                self.invalidate_mirror(repo)
+                return None
+            repo.reset(new_rev)
+        except ExecuteError:
+            return None
+        return 'unchanged' if rev == new_rev else 'update'
+
+    def repo_name(self, repo):
+        url = repo.remote_url()
+        prefix = f'{self._destination()}:'
+        if url is None or not url.startswith(prefix):
+            return None
+        return url.removeprefix(prefix)
+
+    def invalidate_mirror(self, repo):
+        repo_name = self.repo_name(repo)
+        if self._mirror is not None and repo_name is not None:
+            self._mirror.invalidate(repo_name)
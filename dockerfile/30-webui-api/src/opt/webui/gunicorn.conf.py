@@ -0,0 +1,30 @@
+import gc
+import time
+
+wsgi_app = 'wsgi:app'
+workers = 4
+worker_class = 'gthread'
+threads = 8
+accesslog = '-'
+preload_app = True
+
+_forked = None
+
+
+def when_ready(_server):
+    gc.freeze()  # keep preloaded objects out of gc passes so pages stay shared
+
+
+def post_fork(_server, _worker):
+    global _forked
+    _forked = time.monotonic()
+    import daemon  # pylint: disable=import-outside-toplevel
+    daemon.start()
+
+
+def pre_request(worker, _req):
+    global _forked
+    if _forked is not None:
+        worker.log.info('first request %.1f ms after fork',
+                        (time.monotonic() - _forked) * 1000)
+        _forked = None
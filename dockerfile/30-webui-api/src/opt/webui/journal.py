@@ -0,0 +1,58 @@
+import base64
+import json
+import os
+import re
+import tempfile
+
+JOURNAL_MAX = int(os.environ.get('JOURNAL_MAX', '4096'))
+VERSION_RE = '[0-9a-z]+-[0-9]+'
+VERSION_PAT = re.compile(VERSION_RE)
+
+
+class Journal:
+    def __init__(self, path):
+        self._path = path
+
+    def _load(self):
+        try:
+            with open(self._path, encoding='utf-8') as file:
+                lines = file.read().splitlines()
+        except FileNotFoundError:
+            return None, []
+        if not lines:
+            return None, []
+        return lines[0], [json.loads(line) for line in lines[1:]]
+
+    def reset(self):
+        epoch = base64.b32encode(os.urandom(5)).decode().lower()
+        fd, tmp = tempfile.mkstemp('.tmp', '.', os.path.dirname(self._path))
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                file.write(f'{epoch}\n')
+            os.replace(tmp, self._path)
+        except:
+            os.unlink(tmp)
+            raise
+        return f'{epoch}-0'
+
+    def version(self):
+        epoch, paths = self._load()
+        if epoch is None:
+            return self.reset()
+        return f'{epoch}-{len(paths)}'
+
+    def append(self, paths):
+        epoch, journal = self._load()
+        if epoch is None or len(journal) + len(paths) > JOURNAL_MAX:
+            return self.reset()
+        with open(self._path, 'a', encoding='utf-8') as file:
+            file.write(''.join(f'{json.dumps(path)}\n' for path in paths))
+        return f'{epoch}-{len(journal) + len(paths)}'
+
+    def since(self, version):
+        epoch, paths = self._load()
+        since_epoch, count = version.rsplit('-', 1)
+        count = int(count)
+        if epoch is None or since_epoch != epoch or count > len(paths):
+            return None
+        return set(paths[count:])
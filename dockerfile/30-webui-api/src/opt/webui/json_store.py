@@ -1,5 +1,7 @@
 import fcntl
 import json
+import time
+import stats
 
 
 class JsonStore:
@@ -48,7 +50,10 @@ class JsonStore:
             self._modified = False
 
     def lock(self):
+        start = time.monotonic()
         fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        stats.observe('session_lock_wait_seconds', time.monotonic() - start,
+                      backend='file')
 
     def get(self, key, default=None):
         return self._data.get(key, default)
@@ -1,5 +1,13 @@
-from wsgiref.simple_server import make_server
+import socketserver
+from wsgiref.simple_server import WSGIServer, make_server
+import daemon
 from wsgi import app
 
-with make_server('localhost', 8080, app) as httpd:
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+daemon.start()
+with make_server('localhost', 8080, app, ThreadingWSGIServer) as httpd:
     httpd.serve_forever()
@@ -1,53 +1,69 @@
-import collections
-import re
-import apt
+import contextlib
+import fcntl
+import os
+import pkg_index
+from pkg_index import PKG_INDEX
 
 
-def apt_search(query, first=0, count=50):
-    if first < 0 or count <= 0:
-        return []
+def _packages(cache):
+    for package in cache:
+        version = package.candidate
+        if version is None:
+            continue
+        depends = [
+            dependency.or_dependencies[0].name
+            for dependency in version.get_dependencies('Depends')
+        ]
+        yield package.name, version.summary, version.installed_size, depends
+
+
+def _apt_cache():
+    import apt  # pylint: disable=import-outside-toplevel
+    return apt.cache.Cache()
+
+
+@contextlib.contextmanager
+def _index_lock():
+    with open(f'{PKG_INDEX}.lock', 'wb') as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        yield
+
+
+def apt_index(rebuild=True):
+    with _index_lock():
+        if rebuild or not os.path.exists(PKG_INDEX):
+            pkg_index.write(PKG_INDEX, _packages(_apt_cache()))
+
+
+def _index():
     try:
-        pat = re.compile(query)
-    except re.error:
-        return []
-    match = []
-    found = 0
-    for package in apt.cache.Cache():
-        if pat.match(package.name):
-            if found >= first:
-                match.append({
-                  'name': package.name,
-                  'desc': package.candidate.summary
-                })
-            found += 1
-            if found >= first + count:
-                break
-    return match
+        return pkg_index.load()
+    except FileNotFoundError:
+        apt_index(rebuild=False)
+        return pkg_index.load()
+
+
+def apt_preload():
+    _index()
+
+
+def apt_search(query, first=0, count=50):
+    return _index().search(query, first, count)
 
 
 def apt_list(packages):
-    cache = apt.cache.Cache()
-    roots = set(packages)
-    visited = set()
+    index = _index()
     pkginfo = {}
-    total_size = 0
-    stack = collections.deque(packages)
-    while len(stack) > 0:
-        item = stack.pop()
-        if item in visited:
-            continue
-        visited.add(item)
-        if item not in cache:
-            continue
-        version = cache[item].candidate
-        if item in roots:
-            pkginfo[item] = {'desc': version.summary}
-        total_size += version.installed_size
-        for dependency in version.get_dependencies('Depends'):
-            stack.append(dependency.or_dependencies[0].name)
-    return {'packages': pkginfo, 'size': total_size}
+    roots = set()
+    for item in packages:
+        i = index.find(item)
+        if i is not None:
+            pkginfo[item] = {'desc': index.desc(i)}
+            roots.add(i)
+    return {'packages': pkginfo, 'size': index.closure_size(roots)}
 
 
 def apt_update():
-    cache = apt.cache.Cache()
-    cache.update()
+    with _index_lock():
+        _apt_cache().update()
+        pkg_index.write(PKG_INDEX, _packages(_apt_cache()))
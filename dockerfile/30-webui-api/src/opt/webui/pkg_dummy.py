@@ -1,3 +1,7 @@
+def apt_preload():
+    pass
+
+
 def apt_search(query, first=0, count=50):
     return []
 
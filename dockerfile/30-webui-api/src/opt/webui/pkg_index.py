@@ -0,0 +1,201 @@
+import bisect
+import functools
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+
+PKG_INDEX = os.environ.get('PKG_INDEX', 'pkg.index')
+
+_MAGIC = b'GTKPKG1\0'
+_SECTIONS = ('names', 'name_off', 'descs', 'desc_off', 'sizes', 'dep_off',
+             'deps')
+_HEADER = struct.Struct('<8sI4x' + 'QQ' * len(_SECTIONS))
+_LITERAL_PAT = re.compile(r'[^.^$*+?{}\[\]\\|()\n]*')
+_FLAGS_PAT = re.compile(r'\(\?[aiLmsux]+\)')
+_UNSAFE_PAT = re.compile(
+    r'\\[AZ]|\(\?[<=!>]|\[\^|[*+?}]\+|\(\?[aiLmux-]*s'
+)
+
+_lock = threading.Lock()
+_current = None
+
+
+class PackageIndex:
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, *table = _HEADER.unpack_from(self._mmap)
+        if magic != _MAGIC:
+            raise ValueError(f'{path}: not a package index')
+        view = memoryview(self._mmap)
+        sections = {}
+        for i, name in enumerate(_SECTIONS):
+            offset, length = table[2 * i], table[2 * i + 1]
+            sections[name] = view[offset:offset + length]
+        self._names = sections['names']
+        self._names_start = table[0]
+        self._descs = sections['descs']
+        self._name_off = sections['name_off'].cast('I')
+        self._desc_off = sections['desc_off'].cast('I')
+        self.sizes = sections['sizes'].cast('Q')
+        self._dep_off = sections['dep_off'].cast('I')
+        self._deps = sections['deps'].cast('I')
+        self.closure = functools.lru_cache(maxsize=4096)(self._closure)
+        self._size = functools.lru_cache(maxsize=1024)(self._total_size)
+
+    def name(self, i):
+        start, end = self._name_off[i], self._name_off[i + 1] - 1
+        return bytes(self._names[start:end]).decode('utf-8')
+
+    def desc(self, i):
+        start, end = self._desc_off[i], self._desc_off[i + 1]
+        return bytes(self._descs[start:end]).decode('utf-8')
+
+    def depends(self, i):
+        return self._deps[self._dep_off[i]:self._dep_off[i + 1]]
+
+    def _closure(self, i):
+        visited = {i}
+        stack = [i]
+        while stack:
+            for dependency in self.depends(stack.pop()):
+                if dependency not in visited:
+                    visited.add(dependency)
+                    stack.append(dependency)
+        return frozenset(visited)
+
+    def _total_size(self, roots):
+        closure = set()
+        for i in roots:
+            closure |= self.closure(i)
+        return sum(self.sizes[i] for i in closure)
+
+    def closure_size(self, roots):
+        return self._size(frozenset(roots))
+
+    def find(self, name):
+        i = bisect.bisect_left(range(self.count), name, key=self.name)
+        if i < self.count and self.name(i) == name:
+            return i
+        return None
+
+    def _line(self, pos):
+        return bisect.bisect_right(self._name_off, pos) - 1
+
+    def _prefix(self, prefix):
+        i = bisect.bisect_left(range(self.count), prefix, key=self.name)
+        while i < self.count and self.name(i).startswith(prefix):
+            yield i
+            i += 1
+
+    def _substring(self, text):
+        if not text:
+            yield from range(self.count)
+            return
+        needle = text.encode('utf-8')
+        start = self._names_start
+        end = start + len(self._names)
+        last = -1
+        pos = self._mmap.find(needle, start, end)
+        while pos >= 0:
+            i = self._line(pos - start)
+            if i != last and i < self.count:
+                yield i
+                last = i
+            pos = self._mmap.find(needle, pos + 1, end)
+
+    def _regex(self, query, pat):
+        flags = _FLAGS_PAT.match(query)
+        head = flags.group(0) if flags else ''
+        body = query[len(head):]
+        try:
+            if _UNSAFE_PAT.search(query):
+                raise re.error('unsafe for multiline scan')
+            scan = re.compile(
+                f'{head}(?m)^(?=(?:{body}))'.encode('utf-8')
+            )
+        except re.error:
+            for i in range(self.count):
+                if pat.match(self.name(i)):
+                    yield i
+            return
+        for match in scan.finditer(self._names):
+            i = self._line(match.start())
+            if i < self.count and pat.match(self.name(i)):
+                yield i
+
+    def search(self, query, first=0, count=50):
+        if first < 0 or count <= 0:
+            return []
+        try:
+            pat = re.compile(query)
+        except re.error:
+            return []
+        if _LITERAL_PAT.fullmatch(query):
+            found = self._prefix(query)
+        elif query.startswith('.*') and _LITERAL_PAT.fullmatch(query[2:]):
+            found = self._substring(query[2:])
+        else:
+            found = self._regex(query, pat)
+        result = []
+        for n, i in enumerate(found):
+            if n >= first + count:
+                break
+            if n >= first:
+                result.append({'name': self.name(i), 'desc': self.desc(i)})
+        return result
+
+
+def load(path=PKG_INDEX):
+    global _current
+    stat = os.stat(path)
+    key = (stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+    with _lock:
+        if _current is None or _current[0] != key:
+            _current = (key, PackageIndex(path))
+        return _current[1]
+
+
+def _pack(fmt, items):
+    return struct.pack(f'<{len(items)}{fmt}', *items)
+
+
+def write(path, packages):
+    packages = sorted(packages, key=lambda package: package[0])
+    numbers = {package[0]: i for i, package in enumerate(packages)}
+    names, name_off = bytearray(), [0]
+    descs, desc_off = bytearray(), [0]
+    sizes, dep_off, deps = [], [0], []
+    for name, desc, size, depends in packages:
+        names += name.encode('utf-8') + b'\n'
+        name_off.append(len(names))
+        descs += (desc or '').encode('utf-8')
+        desc_off.append(len(descs))
+        sizes.append(size)
+        deps.extend(numbers[dep] for dep in depends if dep in numbers)
+        dep_off.append(len(deps))
+    sections = [
+        names, _pack('I', name_off), descs, _pack('I', desc_off),
+        _pack('Q', sizes), _pack('I', dep_off), _pack('I', deps)
+    ]
+    table = []
+    offset = _HEADER.size
+    for section in sections:
+        offset += -offset % 8
+        table += [offset, len(section)]
+        offset += len(section)
+    fd, tmp = tempfile.mkstemp('.tmp', '.', os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(_HEADER.pack(_MAGIC, len(packages), *table))
+            for section in sections:
+                file.write(b'\0' * (-file.tell() % 8))
+                file.write(section)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except:
+        os.unlink(tmp)
+        raise
@@ -5,6 +5,9 @@ import os
 from response import BadRequest, HTTPError, SECURE_COOKIE
 
 UPLOAD_SIZE_MAX = int(os.environ.get('UPLOAD_SIZE_MAX', '4194304'))
+UPLOAD_BATCH_SIZE_MAX = int(
+    os.environ.get('UPLOAD_BATCH_SIZE_MAX', '67108864')
+)
 
 
 def _check_csrf(environ):
@@ -19,14 +22,37 @@ def _check_csrf(environ):
             raise BadRequest()
 
 
-def _get_body(environ):
+class _Input:
+    def __init__(self, stream, length):
+        self._stream = stream
+        self._remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._stream.read(size) if size > 0 else b''
+        if size > 0 and not data:
+            raise BadRequest('incomplete request body')
+        self._remaining -= len(data)
+        return data
+
+
+def _get_length(environ, limit):
     try:
         length = int(environ['CONTENT_LENGTH'])
     except (ValueError, KeyError) as e:
         raise BadRequest() from e
-    if length > UPLOAD_SIZE_MAX:
+    if length > limit:
         raise HTTPError('413 Large', 'content too large')
-    return environ['wsgi.input'].read(length)
+    return length
+
+
+def _get_body(environ):
+    return environ['wsgi.input'].read(_get_length(environ, UPLOAD_SIZE_MAX))
+
+
+def _get_stream(environ, limit):
+    return _Input(environ['wsgi.input'], _get_length(environ, limit))
 
 
 class Request:
@@ -47,14 +73,22 @@ class Request:
         elif self.method == 'PUT':
             if environ.get('CONTENT_TYPE') != 'application/octet-stream':
                 raise BadRequest()
-            self.body = _get_body(environ)
+            self.body = _get_stream(environ, UPLOAD_SIZE_MAX)
+        elif self.method == 'PATCH':
+            if environ.get('CONTENT_TYPE') != 'application/x-tar':
+                raise BadRequest()
+            self.body = _get_stream(environ, UPLOAD_BATCH_SIZE_MAX)
         else:
             self.body = None
 
+        self._environ = environ
         self._cookie = http.cookies.SimpleCookie()
         if 'HTTP_COOKIE' in environ:
             self._cookie.load(environ['HTTP_COOKIE'])
 
+    def get_header(self, key):
+        return self._environ.get(f'HTTP_{key.upper().replace("-", "_")}')
+
     def get_cookie(self, key):
         item = self._cookie.get(f'__Host-{key}' if SECURE_COOKIE else key)
         return None if item is None else item.value
@@ -1,8 +1,11 @@
+import collections.abc
 import http.cookies
 import json
 import os
+import wsgiref.util
 
 SECURE_COOKIE = os.environ.get('SECURE_COOKIE', 'true') == 'true'
+BLOCK_SIZE = 1 << 16
 
 
 class Response:
@@ -35,6 +38,15 @@ class Response:
             return data.encode('utf-8')
         return data
 
+    def iterable(self, data, file_wrapper=None):
+        if hasattr(data, 'read'):
+            if file_wrapper is None:
+                file_wrapper = wsgiref.util.FileWrapper
+            return file_wrapper(data, BLOCK_SIZE)
+        if isinstance(data, collections.abc.Iterator):
+            return data
+        return [self.body(data)]
+
 
 class HTTPError(Exception):
     def __init__(self, status, body=None):
@@ -53,3 +65,10 @@ class BadRequest(HTTPError):
 class Forbidden(HTTPError):
     def __init__(self, body='forbidden'):
         super().__init__('403 Forbidden', body)
+
+
+class ServiceUnavailable(HTTPError):
+    def __init__(self, body='service unavailable', retry_after=None):
+        super().__init__('503 Service Unavailable', body)
+        if retry_after is not None:
+            self.response.headers.append(('Retry-After', str(retry_after)))
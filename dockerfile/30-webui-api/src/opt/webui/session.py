@@ -6,9 +6,15 @@ import shutil
 import sys
 from json_store import JsonStore
 from response import Forbidden
+from session_sqlite import SqliteStore
+from session_token import TokenStore
 
 SESSION_DIR = os.environ.get('SESSION_DIR', 'sessions')
 SESSION_TIMEOUT = int(os.environ.get('SESSION_TIMEOUT', '1200'))
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'sqlite')
+SESSION_DB = os.environ.get('SESSION_DB',
+                            os.path.join(SESSION_DIR, 'sessions.db'))
+SESSION_SECRET = os.environ.get('SESSION_SECRET')
 
 
 def _create_session_dir():
@@ -33,17 +39,78 @@ def _rename_session_dir(session_id):
         raise
 
 
+class FileStore:
+    def dir(self, session_id):
+        return os.path.join(SESSION_DIR, session_id)
+
+    def create(self, user, start):
+        session_dir = _create_session_dir()
+        try:
+            with JsonStore(os.path.join(session_dir, 'data.json'),
+                           True) as data:
+                data['user'] = user
+                data['start'] = start
+        except:
+            shutil.rmtree(session_dir, ignore_errors=True)
+            raise
+        return os.path.basename(session_dir)
+
+    def open(self, session_id):
+        data = JsonStore(os.path.join(self.dir(session_id), 'data.json'))
+        try:
+            data.__enter__()
+        except OSError:
+            return None  # no such session
+        return data
+
+    def refresh(self, session_id, data, start):
+        old_start = data['start']
+        data.lock()
+        data.reload()
+        if old_start != data['start']:
+            raise Forbidden('Session closed')  # session has been refreshed
+        new_id = _rename_session_dir(session_id)
+        data['start'] = start
+        return new_id
+
+    def remove(self, session_id):
+        _remove_session_dir(session_id)
+
+    def reap(self, deadline):
+        try:
+            sessions = os.listdir(SESSION_DIR)
+        except OSError:
+            return
+        for session_id in sessions:
+            if session_id.startswith('.'):
+                continue  # not a session, e.g. the git mirrors
+            try:
+                data_json = os.path.join(SESSION_DIR, session_id, 'data.json')
+                with JsonStore(data_json) as data:
+                    data.lock()
+                    start = data['start']
+                    if start is None or start < deadline:
+                        _remove_session_dir(session_id)
+            except OSError:
+                _remove_session_dir(session_id)
+
+
+def _create_store():
+    if SESSION_BACKEND == 'file':
+        return FileStore()
+    if SESSION_BACKEND == 'sqlite':
+        return SqliteStore(SESSION_DIR, SESSION_DB)
+    if SESSION_BACKEND == 'token':
+        return TokenStore(SESSION_DIR, SESSION_SECRET, SESSION_TIMEOUT)
+    raise ValueError(f'unknown SESSION_BACKEND: {SESSION_BACKEND}')
+
+
+STORE = _create_store()
+
+
 def create_session(user, res):
     now = time.time()
-    session_dir = _create_session_dir()
-    try:
-        with JsonStore(os.path.join(session_dir, 'data.json'), True) as data:
-            data['user'] = user
-            data['start'] = now
-    except:
-        shutil.rmtree(session_dir, ignore_errors=True)
-        raise
-    session_id = os.path.basename(session_dir)
+    session_id = STORE.create(user, now)
     res.set_cookie('id', session_id)
     res.headers.append(('Cache-Control', 'no-store'))
     return {'user': user, 'ttl': now + SESSION_TIMEOUT}
@@ -56,21 +123,19 @@ class Session:
         self.data = None
 
     def dir(self):
-        return os.path.join(SESSION_DIR, self.id)
+        return STORE.dir(self.id)
 
     def __enter__(self):
         self.id = self.req.get_cookie('id')
         if not self.id:
             raise Forbidden('Session closed')  # token not given
-        self.data = JsonStore(os.path.join(self.dir(), 'data.json'))
-        try:
-            self.data.__enter__()
-        except OSError as e:
-            raise Forbidden('Session closed') from e  # no such session
+        self.data = STORE.open(self.id)
+        if self.data is None:
+            raise Forbidden('Session closed')  # no such session
         try:
             start = self.data['start']
             if start + SESSION_TIMEOUT < time.time():
-                _remove_session_dir(self.id)
+                STORE.remove(self.id)
                 raise Forbidden('Session closed')  # session expired
             return self
         except:
@@ -82,37 +147,16 @@ class Session:
             self.data.__exit__(exc, val, tb)
 
     def refresh(self, res):
-        start = self.data['start']
-        self.data.lock()
-        self.data.reload()
-        if start != self.data['start']:
-            raise Forbidden('Session closed')  # session has been refreshed
-        new_id = _rename_session_dir(self.id)
-        self.data['start'] = time.time()
-        self.id = new_id
-        res.set_cookie('id', new_id, max_age=SESSION_TIMEOUT)
+        now = time.time()
+        self.id = STORE.refresh(self.id, self.data, now)
+        res.set_cookie('id', self.id, max_age=SESSION_TIMEOUT)
         res.headers.append(('Cache-Control', 'no-store'))
-        return {'user': self.data['user'],
-                'ttl': self.data['start'] + SESSION_TIMEOUT}
+        return {'user': self.data['user'], 'ttl': now + SESSION_TIMEOUT}
 
     def logout(self, res):
-        _remove_session_dir(self.id)
+        STORE.remove(self.id)
         res.set_cookie('id', '', max_age=0)
 
 
 def reap_sessions():
-    now = time.time()
-    try:
-        sessions = os.listdir(SESSION_DIR)
-    except OSError:
-        return
-    for session_id in sessions:
-        try:
-            data_json = os.path.join(SESSION_DIR, session_id, 'data.json')
-            with JsonStore(data_json) as data:
-                data.lock()
-                start = data['start']
-                if start is None or start + SESSION_TIMEOUT < now:
-                    _remove_session_dir(session_id)
-        except OSError:
-            _remove_session_dir(session_id)
+    STORE.reap(time.time() - SESSION_TIMEOUT)
@@ -0,0 +1,182 @@
+import base64
+import fcntl
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import stats
+from response import Forbidden
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    user TEXT NOT NULL,
+    start REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sessions_start ON sessions (start);
+'''
+_ID_PAT = re.compile(r'([A-Za-z0-9_-]{24})(\.lock)?')
+
+
+def _new_id():
+    return base64.urlsafe_b64encode(os.urandom(18)).decode()
+
+
+class SessionData:
+    def __init__(self, store, session_id, user, start):
+        self._store = store
+        self._id = session_id
+        self._data = {'user': user, 'start': start}
+        self._lock = None
+        self._exclusive = False
+
+    def _flock(self, operation):
+        start = time.monotonic()
+        fcntl.flock(self._lock.fileno(), operation)
+        stats.observe('session_lock_wait_seconds', time.monotonic() - start,
+                      backend='sqlite')
+
+    def __enter__(self):
+        self._lock = open(self._store.lock_path(self._id), 'ab')
+        try:
+            self._flock(fcntl.LOCK_SH)
+            self.reload()
+        except:
+            self.__exit__(*sys.exc_info())
+            raise
+        return self
+
+    def __exit__(self, exc, val, tb):
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+            self._exclusive = False
+
+    def lock(self):
+        if self._exclusive:
+            return
+        self._flock(fcntl.LOCK_EX)
+        self._exclusive = True
+        self.reload()
+
+    def reload(self):
+        row = self._store.load(self._id)
+        if row is None or row[1] != self._data['start']:
+            raise Forbidden('Session closed')  # session has been refreshed
+
+    def refreshed(self, session_id, start):
+        self._id = session_id
+        self._data['start'] = start
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+
+class SqliteStore:
+    def __init__(self, session_dir, path):
+        self._dir = session_dir
+        self._path = path
+        self._local = threading.local()
+
+    def _db(self):
+        db, pid = getattr(self._local, 'db', (None, None))
+        if pid != os.getpid():
+            os.makedirs(self._dir, exist_ok=True)
+            db = sqlite3.connect(self._path, timeout=10,
+                                 isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.executescript(_SCHEMA)
+            self._local.db = db, os.getpid()
+        return db
+
+    def dir(self, session_id):
+        return os.path.join(self._dir, session_id)
+
+    def lock_path(self, session_id):
+        return os.path.join(self._dir, f'{session_id}.lock')
+
+    def create(self, user, start):
+        session_id = _new_id()
+        self._db().execute('INSERT INTO sessions VALUES (?, ?, ?)',
+                           (session_id, user, start))
+        return session_id
+
+    def load(self, session_id):
+        return self._db().execute(
+            'SELECT user, start FROM sessions WHERE id = ?', (session_id,)
+        ).fetchone()
+
+    def open(self, session_id):
+        row = self.load(session_id)
+        if row is None:
+            return None
+        try:
+            return SessionData(self, session_id, *row).__enter__()
+        except Forbidden:
+            return None  # refreshed or removed while opening
+
+    def refresh(self, session_id, data, start):
+        data.lock()
+        new_id = _new_id()
+        cursor = self._db().execute(
+            'UPDATE sessions SET id = ?, start = ? WHERE id = ? AND start = ?',
+            (new_id, start, session_id, data['start'])
+        )
+        if cursor.rowcount != 1:
+            raise Forbidden('Session closed')  # session has been refreshed
+        for old, new in ((self.dir(session_id), self.dir(new_id)),
+                         (self.lock_path(session_id), self.lock_path(new_id))):
+            try:
+                os.rename(old, new)
+            except FileNotFoundError:
+                pass
+        data.refreshed(new_id, start)
+        return new_id
+
+    def _remove_files(self, session_id):
+        shutil.rmtree(self.dir(session_id), ignore_errors=True)
+        try:
+            os.remove(self.lock_path(session_id))
+        except FileNotFoundError:
+            pass
+
+    def remove(self, session_id):
+        self._db().execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+        self._remove_files(session_id)
+
+    def _reap_orphan(self, session_id):
+        with open(self.lock_path(session_id), 'ab') as lock:
+            try:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # being refreshed
+            if self.load(session_id) is None:
+                self._remove_files(session_id)
+
+    def reap(self, deadline):
+        rows = self._db().execute(
+            'DELETE FROM sessions WHERE start < ? RETURNING id', (deadline,)
+        ).fetchall()
+        for session_id, in rows:
+            self._remove_files(session_id)
+        try:
+            entries = os.listdir(self._dir)
+        except OSError:
+            return
+        for name in entries:
+            match = _ID_PAT.fullmatch(name)
+            if match is None:
+                continue
+            try:
+                mtime = os.stat(os.path.join(self._dir, name)).st_mtime
+            except FileNotFoundError:
+                continue
+            if mtime < deadline and self.load(match.group(1)) is None:
+                self._reap_orphan(match.group(1))
@@ -0,0 +1,210 @@
+import base64
+import binascii
+import fcntl
+import hmac
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import stats
+from response import Forbidden
+
+_ID_PAT = re.compile(r'([A-Za-z0-9_-]{16})(\.lock|\.state)?')
+_CLOSED = 'closed'
+
+
+def _encode(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def _decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+class TokenData:
+    def __init__(self, store, session_id, user, start, rotation):
+        self._store = store
+        self.id = session_id
+        self._data = {'user': user, 'start': start}
+        self.rotation = rotation
+        self._lock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, val, tb):
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+
+    def lock(self):
+        if self._lock is not None:
+            return
+        self._lock = open(self._store.lock_path(self.id), 'ab')
+        start = time.monotonic()
+        fcntl.flock(self._lock.fileno(), fcntl.LOCK_EX)
+        stats.observe('session_lock_wait_seconds', time.monotonic() - start,
+                      backend='token')
+        self.reload()
+
+    def reload(self):
+        if self._store.rotation(self.id) != self.rotation:
+            raise Forbidden('Session closed')  # session has been refreshed
+
+    def refreshed(self, start, rotation):
+        self._data['start'] = start
+        self.rotation = rotation
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+
+class TokenStore:
+    def __init__(self, session_dir, secret, timeout):
+        if not secret:
+            raise ValueError('SESSION_SECRET is required for token sessions')
+        self._dir = session_dir
+        self._key = secret.encode('utf-8')
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._revoked = {}
+
+    def _revoke(self, session_id, rotation):
+        now = time.time()
+        with self._lock:
+            current = self._revoked.get(session_id, (0, now))[0]
+            if current is None or (rotation is not None
+                                   and rotation <= current):
+                return
+            # entries outlive every token they revoke by at most timeout
+            self._revoked = {key: entry
+                             for key, entry in self._revoked.items()
+                             if entry[1] + self._timeout >= now}
+            self._revoked[session_id] = (rotation, now)
+
+    def _is_revoked(self, data):
+        with self._lock:
+            entry = self._revoked.get(data.id)
+        return entry is not None and (entry[0] is None
+                                      or data.rotation < entry[0])
+
+    def _sign(self, payload):
+        return _encode(hmac.digest(self._key, payload.encode(), 'sha256'))
+
+    def _token(self, data):
+        payload = _encode(json.dumps(
+            [data.id, data['user'], data['start'], data.rotation],
+            separators=(',', ':')
+        ).encode('utf-8'))
+        return f'{payload}.{self._sign(payload)}'
+
+    def _parse(self, token):
+        payload, _, signature = token.partition('.')
+        if not hmac.compare_digest(self._sign(payload), signature):
+            return None
+        try:
+            session_id, user, start, rotation = json.loads(_decode(payload))
+        except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+            return None
+        if not (isinstance(session_id, str) and _ID_PAT.fullmatch(session_id)
+                and isinstance(user, str)
+                and isinstance(start, (int, float))
+                and isinstance(rotation, int)):
+            return None
+        return TokenData(self, session_id, user, start, rotation)
+
+    def _state_path(self, session_id):
+        return os.path.join(self._dir, f'{session_id}.state')
+
+    def _write_state(self, session_id, state):
+        os.makedirs(self._dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp('.tmp', '.', self._dir)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                file.write(state)
+            os.replace(tmp, self._state_path(session_id))
+        except:
+            os.unlink(tmp)
+            raise
+
+    def rotation(self, session_id):
+        try:
+            with open(self._state_path(session_id), encoding='utf-8') as file:
+                state = file.read()
+        except FileNotFoundError:
+            return 0
+        rotation = None if state == _CLOSED else int(state)
+        self._revoke(session_id, rotation)
+        return rotation
+
+    def lock_path(self, session_id):
+        os.makedirs(self._dir, exist_ok=True)
+        return os.path.join(self._dir, f'{session_id}.lock')
+
+    def dir(self, token):
+        data = self._parse(token)
+        if data is None:
+            raise Forbidden('Session closed')  # no such session
+        data.reload()
+        return os.path.join(self._dir, data.id)
+
+    def create(self, user, start):
+        session_id = _encode(os.urandom(12))
+        return self._token(TokenData(self, session_id, user, start, 0))
+
+    def open(self, token):
+        data = self._parse(token)
+        if data is None or self._is_revoked(data):
+            return None  # logged out or superseded by a refresh
+        return data
+
+    def refresh(self, _token, data, start):
+        data.lock()
+        data.reload()
+        self._write_state(data.id, str(data.rotation + 1))
+        self._revoke(data.id, data.rotation + 1)
+        data.refreshed(start, data.rotation + 1)
+        return self._token(data)
+
+    def remove(self, token):
+        data = self._parse(token)
+        if data is None:
+            return
+        with data:
+            data.lock()
+            self._write_state(data.id, _CLOSED)
+            self._revoke(data.id, None)
+            shutil.rmtree(os.path.join(self._dir, data.id), ignore_errors=True)
+
+    def reap(self, deadline):
+        try:
+            entries = os.listdir(self._dir)
+        except OSError:
+            return
+        used = {}
+        for name in entries:
+            match = _ID_PAT.fullmatch(name)
+            if match is None:
+                continue
+            try:
+                mtime = os.stat(os.path.join(self._dir, name)).st_mtime
+            except FileNotFoundError:
+                continue
+            session_id = match.group(1)
+            used[session_id] = max(used.get(session_id, mtime), mtime)
+        for session_id, mtime in used.items():
+            if mtime >= deadline:
+                continue
+            shutil.rmtree(os.path.join(self._dir, session_id),
+                          ignore_errors=True)
+            for suffix in ('.state', '.lock'):
+                try:
+                    os.remove(os.path.join(self._dir, session_id + suffix))
+                except FileNotFoundError:
+                    pass
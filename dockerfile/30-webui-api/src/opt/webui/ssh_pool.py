@@ -0,0 +1,108 @@
+import atexit
+import os
+import shlex
+import threading
+import time
+from execute import execute, ExecuteError
+
+SSH_COMMAND = os.environ.get('SSH_COMMAND', 'ssh')
+SSH_CONTROL_DIR = os.environ.get('SSH_CONTROL_DIR', 'ssh-control')
+SSH_CONTROL_PERSIST = int(os.environ.get('SSH_CONTROL_PERSIST', '300'))
+SSH_CHECK_INTERVAL = int(os.environ.get('SSH_CHECK_INTERVAL', '30'))
+SSH_CONNECTION_LOST = 255
+
+
+class SshPool:
+    def __init__(self, command=SSH_COMMAND, control_dir=SSH_CONTROL_DIR,
+                 persist=SSH_CONTROL_PERSIST,
+                 check_interval=SSH_CHECK_INTERVAL):
+        self._command = shlex.split(command)
+        self._control_dir = os.path.abspath(control_dir)
+        self._persist = persist
+        self._check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked = {}
+        self._used = set()
+
+    def _control_path(self):
+        return os.path.join(self._control_dir, f'{os.getpid()}-%C')
+
+    def _options(self):
+        return [
+            '-o', 'ControlMaster=auto',
+            '-o', f'ControlPath={self._control_path()}',
+            '-o', f'ControlPersist={self._persist}',
+            '-o', 'ServerAliveInterval=15',
+            '-o', 'ServerAliveCountMax=2'
+        ]
+
+    def command(self):
+        if self._persist <= 0:
+            return self.one_shot_command()
+        try:
+            os.makedirs(self._control_dir, mode=0o700, exist_ok=True)
+        except OSError:
+            return self.one_shot_command()
+        return [*self._command, *self._options()]
+
+    def one_shot_command(self):
+        return [*self._command, '-o', 'ControlMaster=no',
+                '-o', 'ControlPath=none']
+
+    def _control(self, operation, destination):
+        execute(*self._command, *self._options(), '-O', operation,
+                destination, label=f'ssh -O {operation}')
+
+    def check(self, destination):
+        if self._persist <= 0:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            self._used.add(destination)
+            checked, alive = self._checked.get(destination, (None, False))
+        if checked is not None and now - checked < self._check_interval:
+            return alive
+        try:
+            self._control('check', destination)
+            alive = True
+        except ExecuteError:
+            alive = False
+        with self._lock:
+            self._checked[destination] = (now, alive)
+        return alive
+
+    def evict(self, destination):
+        with self._lock:
+            self._checked.pop(destination, None)
+        try:
+            self._control('exit', destination)
+        except ExecuteError:
+            pass
+
+    def close(self):
+        with self._lock:
+            destinations = [*self._used]
+            self._used.clear()
+        for destination in destinations:
+            self.evict(destination)
+
+    def run(self, destination, *command, idempotent=False, **kwargs):
+        kwargs.setdefault('label', f'ssh {command[0]}')
+        self.check(destination)
+        try:
+            return execute(*self.command(), destination, *command, **kwargs)
+        except ExecuteError as e:
+            if (e.status != SSH_CONNECTION_LOST or self._persist <= 0
+                    or not idempotent):
+                raise
+        self.evict(destination)
+        return execute(*self.one_shot_command(), destination, *command,
+                       **kwargs)
+
+    def git_env(self, destination):
+        self.check(destination)
+        return {'GIT_SSH_COMMAND': shlex.join(self.command())}
+
+
+SSH_POOL = SshPool()
+atexit.register(SSH_POOL.close)
@@ -0,0 +1,212 @@
+import atexit
+import bisect
+import collections
+import json
+import os
+import tempfile
+import threading
+import time
+import traceback
+
+STATS_DIR = os.environ.get('STATS_DIR', 'stats')
+STATS_FLUSH_INTERVAL = float(os.environ.get('STATS_FLUSH_INTERVAL', '5'))
+STATS_RETENTION = int(os.environ.get('STATS_RETENTION', '86400'))
+METRICS_PREFIX = 'webui_'
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+           120, 300)
+
+_lock = threading.Lock()
+_counters = collections.Counter()
+_gauges = set()
+_histograms = {}
+_spool_path = None
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def incr(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] += value
+
+
+def gauge(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _gauges.add(name)
+        _counters[key] += value
+
+
+def observe(name, value, **labels):
+    key = _key(name, labels)
+    index = bisect.bisect_left(BUCKETS, value)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0]
+        histogram[0][index] += 1
+        histogram[1] += value
+
+
+def snapshot():
+    with _lock:
+        items = [*_counters.items()]
+    return [
+        {'name': name, 'labels': dict(labels), 'value': value}
+        for (name, labels), value in sorted(items)
+    ]
+
+
+def _spool():
+    with _lock:
+        return {
+            'counters': [[name, dict(labels), value]
+                         for (name, labels), value in _counters.items()
+                         if name not in _gauges],
+            'gauges': [[name, dict(labels), value]
+                       for (name, labels), value in _counters.items()
+                       if name in _gauges],
+            'histograms': [[name, dict(labels), [*buckets], total]
+                           for (name, labels), (buckets, total)
+                           in _histograms.items()],
+        }
+
+
+def _path():
+    global _spool_path
+    pid = os.getpid()
+    with _lock:
+        # a reused pid must not overwrite an exited worker's totals
+        if _spool_path is None or _spool_path[0] != pid:
+            _spool_path = pid, os.path.join(STATS_DIR,
+                                            f'{pid}-{time.time_ns()}.json')
+        return _spool_path[1]
+
+
+def flush():
+    os.makedirs(STATS_DIR, exist_ok=True)
+    path = _path()
+    fd, tmp = tempfile.mkstemp('.tmp', '.', STATS_DIR)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump(_spool(), file, separators=(',', ':'))
+        os.replace(tmp, path)
+    except:
+        os.unlink(tmp)
+        raise
+
+
+def _flusher():
+    while True:
+        time.sleep(STATS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception:  # keep flushing after a transient failure
+            traceback.print_exc()
+
+
+def start():
+    atexit.register(flush)
+    threading.Thread(target=_flusher, name='stats', daemon=True).start()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _spools():
+    spools = []
+    for name in os.listdir(STATS_DIR):
+        stem, ext = os.path.splitext(name)
+        pid, sep, start = stem.partition('-')
+        # '<pid>.json' is the older name without a start time
+        if ext == '.json' and pid.isdigit() and (start.isdigit() or not sep):
+            spools.append((int(pid), int(start or 0), name))
+    return spools
+
+
+def _load_spools():
+    flush()
+    spools = _spools()
+    latest = {}
+    for pid, start, _name in spools:
+        latest[pid] = max(latest.get(pid, start), start)
+    for pid, start, name in spools:
+        path = os.path.join(STATS_DIR, name)
+        try:
+            with open(path, encoding='utf-8') as file:
+                alive = start == latest[pid] and _alive(pid)
+                age = time.time() - os.fstat(file.fileno()).st_mtime
+                if not alive and age > STATS_RETENTION:
+                    os.remove(path)
+                    continue
+                yield alive, json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue
+
+
+def collect():
+    counters = collections.Counter()
+    gauges = collections.Counter()
+    histograms = {}
+    for alive, spool in _load_spools():
+        for name, labels, value in spool['counters']:
+            counters[_key(name, labels)] += value
+        if alive:
+            for name, labels, value in spool['gauges']:
+                gauges[_key(name, labels)] += value
+        for name, labels, buckets, total in spool['histograms']:
+            histogram = histograms.setdefault(
+                _key(name, labels), [[0] * (len(BUCKETS) + 1), 0.0])
+            for i, count in enumerate(buckets):
+                histogram[0][i] += count
+            histogram[1] += total
+    return counters, gauges, histograms
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _sample(name, labels, value):
+    if labels:
+        text = ','.join(f'{key}="{_escape(item)}"' for key, item in labels)
+        return f'{name}{{{text}}} {value}'
+    return f'{name} {value}'
+
+
+def render():
+    counters, gauges, histograms = collect()
+    families = {}
+    for (name, labels), value in counters.items():
+        family = families.setdefault(f'{METRICS_PREFIX}{name}_total',
+                                     ('counter', []))
+        family[1].append(_sample(f'{METRICS_PREFIX}{name}_total', labels,
+                                 value))
+    for (name, labels), value in gauges.items():
+        family = families.setdefault(f'{METRICS_PREFIX}{name}', ('gauge', []))
+        family[1].append(_sample(f'{METRICS_PREFIX}{name}', labels, value))
+    for (name, labels), (buckets, total) in histograms.items():
+        name = f'{METRICS_PREFIX}{name}'
+        family = families.setdefault(name, ('histogram', []))
+        count = 0
+        for bound, bucket in zip([*BUCKETS, '+Inf'], buckets):
+            count += bucket
+            family[1].append(_sample(f'{name}_bucket',
+                                     (*labels, ('le', bound)), count))
+        family[1].append(_sample(f'{name}_sum', labels, total))
+        family[1].append(_sample(f'{name}_count', labels, count))
+    lines = []
+    for name, (kind, samples) in sorted(families.items()):
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(samples)
+    return ''.join(f'{line}\n' for line in lines)
@@ -0,0 +1,186 @@
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+import stats
+from execute import ExecuteError
+from response import HTTPError, ServiceUnavailable
+
+WATCH_DIR = os.environ.get('WATCH_DIR', 'watch')
+WATCH_INTERVAL = float(os.environ.get('WATCH_INTERVAL', '2'))
+WATCH_TIMEOUT = int(os.environ.get('WATCH_TIMEOUT', '60'))
+WATCH_MAX = int(os.environ.get('WATCH_MAX', '4'))
+WATCH_RETRY = 1000
+
+_lock = threading.Lock()
+_active = 0
+
+
+def _write(path, data):
+    fd, tmp = tempfile.mkstemp('.tmp', '.', os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(tmp, path)
+    except:
+        os.unlink(tmp)
+        raise
+
+
+def _event(name, data, id=None):
+    lines = [f'event: {name}']
+    if id is not None:
+        lines.append(f'id: {id}')
+    lines.extend(f'data: {line}' for line in data.split('\n'))
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+def _acquire():
+    global _active
+    with _lock:
+        if _active >= WATCH_MAX:
+            return False
+        _active += 1
+        return True
+
+
+def _release():
+    global _active
+    with _lock:
+        _active -= 1
+
+
+class Watcher:
+    def __init__(self, git, repo_name, interval=WATCH_INTERVAL):
+        self._git = git
+        self._repo_name = repo_name
+        self.interval = interval
+        self._dir = os.path.join(WATCH_DIR, git.server, repo_name)
+        self._poll_lock = None
+        self._status_path = os.path.join(self._dir, 'status.json')
+        self._log_path = os.path.join(self._dir, 'log')
+
+    def _leader(self):
+        if self._poll_lock is not None:
+            return True
+        os.makedirs(self._dir, exist_ok=True)
+        lock = open(os.path.join(self._dir, 'poll.lock'), 'ab')
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return False
+        self._poll_lock = lock
+        return True
+
+    def _updated(self):
+        try:
+            return os.stat(self._status_path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def poll(self, wait=None):
+        if not self._leader():
+            return False
+        updated = self._updated()
+        if updated is not None and time.time() < updated + self.interval:
+            return False
+        status = self._git.job_status(self._repo_name, wait=wait)
+        log = self._git.job_log(self._repo_name, wait=wait)
+        _write(self._log_path, log.encode('utf-8'))
+        _write(self._status_path, json.dumps(status).encode('utf-8'))
+        stats.incr('watch_polls')
+        return True
+
+    def prime(self):
+        deadline = time.monotonic() + 5 * self.interval
+        while not self.poll() and self._updated() is None:
+            if time.monotonic() >= deadline:
+                raise HTTPError('504 Gateway Timeout', 'status not available')
+            time.sleep(self.interval / 4)
+
+    def status(self):
+        try:
+            with open(self._status_path, 'rb') as file:
+                return json.load(file)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def log(self, offset):
+        try:
+            with open(self._log_path, 'rb') as file:
+                size = os.fstat(file.fileno()).st_size
+                reset = offset > size
+                if reset:
+                    offset = 0
+                file.seek(offset)
+                data = file.read(size - offset)
+        except FileNotFoundError:
+            return b'', offset, False
+        end = data.rfind(b'\n') + 1
+        return data[:end], offset + end, reset
+
+    def close(self):
+        if self._poll_lock is not None:
+            self._poll_lock.close()
+            self._poll_lock = None
+
+
+class WatchStream:
+    def __init__(self, watcher, offset, timeout=WATCH_TIMEOUT):
+        if not _acquire():
+            raise ServiceUnavailable('too many watchers', WATCH_RETRY // 1000)
+        self._watcher = watcher
+        self._events = iter(())
+        self._closed = False
+        try:
+            watcher.prime()
+        except:
+            self.close()
+            raise
+        self._events = self._generate(offset, time.monotonic() + timeout)
+
+    def _generate(self, offset, deadline):
+        yield f'retry: {WATCH_RETRY}\n\n'.encode('utf-8')
+        status = None
+        while True:
+            sent = False
+            try:
+                self._watcher.poll(wait=0)
+            except (ExecuteError, HTTPError):
+                pass  # keep streaming; the next poll retries
+            current = self._watcher.status()
+            if current is not None and current != status:
+                status = current
+                yield _event('status', json.dumps(status, ensure_ascii=False))
+                sent = True
+            data, offset, reset = self._watcher.log(offset)
+            if reset:
+                yield _event('reset', '', 0)
+                sent = True
+            if data:
+                text = data.decode('utf-8', 'replace').removesuffix('\n')
+                yield _event('log', text, offset)
+                sent = True
+            if not sent:
+                yield b': keepalive\n\n'
+            if time.monotonic() >= deadline:
+                return
+            time.sleep(self._watcher.interval)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._events)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if hasattr(self._events, 'close'):
+            self._events.close()
+        self._watcher.close()
+        _release()
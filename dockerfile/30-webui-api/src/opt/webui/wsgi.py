@@ -2,9 +2,8 @@ from request import Request
 from response import HTTPError, Response
 from dispatch import dispatch
 import app as _app
-import daemon
 
-daemon.start()
+_app.preload()
 
 
 def app(environ, start_response):
@@ -13,7 +12,7 @@ def app(environ, start_response):
         res = Response()
         ret = dispatch(req, res)
         start_response(*res.response())
-        return [res.body(ret)]
+        return res.iterable(ret, environ.get('wsgi.file_wrapper'))
     except HTTPError as e:
         start_response(*e.response.response())
         return [e.response.body(e.body)]
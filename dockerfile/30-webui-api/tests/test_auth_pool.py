@@ -0,0 +1,81 @@
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'opt',
+                                'webui'))
+
+# pylint: disable=wrong-import-position
+import stats  # noqa: E402
+from auth_pool import AuthPool, CredentialCache  # noqa: E402
+
+
+def _count(name, **labels):
+    return sum(item['value'] for item in stats.snapshot()
+               if item['name'] == name and item['labels'] == labels)
+
+
+class StubBackend:
+    def __init__(self, password='right'):
+        self.password = password
+        self.calls = 0
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, _user, password):
+        self.calls += 1
+        self.entered.set()
+        self.release.wait(10)
+        return password == self.password
+
+
+class AuthPoolTest(unittest.TestCase):
+    def test_coalesced(self):
+        backend = StubBackend()
+        backend.release.clear()
+        pool = AuthPool(backend, timeout=10)
+        coalesced = _count('auth_requests', result='coalesced')
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(pool.authenticate('u', 'right')))
+            for _ in range(5)]
+        threads[0].start()
+        self.assertTrue(backend.entered.wait(10))
+        for thread in threads[1:]:
+            thread.start()
+        deadline = time.monotonic() + 10
+        while (_count('auth_requests', result='coalesced') - coalesced < 4
+               and time.monotonic() < deadline):
+            time.sleep(0.01)
+        backend.release.set()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(results, [True] * 5)
+        self.assertEqual(backend.calls, 1)
+
+    def test_cache_ttl(self):
+        backend = StubBackend()
+        pool = AuthPool(backend, cache=CredentialCache(ttl=0.2))
+        self.assertTrue(pool.authenticate('u', 'right'))
+        self.assertTrue(pool.authenticate('u', 'right'))
+        self.assertEqual(backend.calls, 1)
+        time.sleep(0.3)
+        self.assertTrue(pool.authenticate('u', 'right'))
+        self.assertEqual(backend.calls, 2)
+
+    def test_failure_not_cached(self):
+        backend = StubBackend()
+        pool = AuthPool(backend)
+        self.assertFalse(pool.authenticate('u', 'wrong'))
+        self.assertFalse(pool.authenticate('u', 'wrong'))
+        self.assertEqual(backend.calls, 2)
+        self.assertTrue(pool.authenticate('u', 'right'))
+        self.assertFalse(pool.authenticate('u', 'wrong'))
+        self.assertEqual(backend.calls, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
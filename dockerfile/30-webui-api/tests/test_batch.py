@@ -0,0 +1,96 @@
+import io
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'opt',
+                                'webui'))
+
+# pylint: disable=wrong-import-position
+import app  # noqa: E402
+from git_repo import GitRepo  # noqa: E402
+from response import BadRequest  # noqa: E402
+
+FILES = ['src/a', 'src/b', 'src/d/x', 'src/d/sub/y', 'src/o/old', 'src/w/z']
+
+
+def _tar(*entries):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for name, content in entries:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    buffer.seek(0)
+    return tarfile.open(fileobj=buffer, mode='r|')
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        work_dir = self.dir.name
+        for path in FILES:
+            path = os.path.join(work_dir, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(path)
+        for command in (['init', '-q'], ['add', '-A'],
+                        ['-c', 'user.name=t', '-c', 'user.email=t@t',
+                         'commit', '-qm', 'init']):
+            subprocess.run(['git', *command], cwd=work_dir, check=True)
+        self.repo = GitRepo(work_dir)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _batch(self, *entries):
+        with _tar(*entries) as tar:
+            changes = app._extract_batch(self.repo, tar)
+        self.repo.stage(changes)
+        return changes
+
+    def _tree(self):
+        found = set()
+        for root, dirs, files in os.walk(self.dir.name):
+            dirs[:] = [item for item in dirs if item != '.git']
+            found |= {os.path.relpath(os.path.join(root, item), self.dir.name)
+                      for item in files}
+        return found
+
+    def test_mixed_batch(self):
+        changes = self._batch(
+            ('new', b'1'),
+            ('w/z2', b'2'),
+            ('.wh.a', b''),
+            ('./.wh.d', b''),
+            ('d/again', b'3'),
+            ('.wh.w', b''),
+            ('o/.wh..wh..opq', b''),
+            ('o/fresh', b'4'),
+        )
+        expected = {'src/b', 'src/new', 'src/d/again', 'src/o/fresh'}
+        self.assertEqual(set(self.repo.ls_files('src')), expected)
+        self.assertEqual(self._tree(), expected)
+        for path in ('src/a', 'src/d/x', 'src/d/sub/y', 'src/w/z',
+                     'src/w/z2', 'src/o/old'):
+            self.assertIsNone(changes[path])
+
+    def test_whiteout_missing(self):
+        self._batch(('.wh.nothing', b''))
+        self.assertEqual(set(self.repo.ls_files('src')), set(FILES))
+
+    def test_opaque_root(self):
+        self._batch(('.wh..wh..opq', b''), ('only', b'1'))
+        self.assertEqual(set(self.repo.ls_files('src')), {'src/only'})
+        self.assertEqual(self._tree(), {'src/only'})
+
+    def test_invalid_whiteout(self):
+        with self.assertRaises(BadRequest):
+            self._batch(('.wh...', b''))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'opt',
+                                'webui'))
+
+# pylint: disable=wrong-import-position
+import app  # noqa: E402
+import wsgi  # noqa: E402
+from git_repo import GitRepo  # noqa: E402
+
+FILES = ['src/a', 'src/b', 'src/c/d', 'src/e']
+
+
+@contextlib.contextmanager
+def _session(_req):
+    session = types.SimpleNamespace(
+        data=types.SimpleNamespace(lock=lambda: None)
+    )
+    yield session
+
+
+class ListFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        work_dir = self.dir.name
+        for path in FILES:
+            path = os.path.join(work_dir, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write(path)
+        for command in (['init', '-q'], ['add', '-A'],
+                        ['-c', 'user.name=t', '-c', 'user.email=t@t',
+                         'commit', '-qm', 'init']):
+            subprocess.run(['git', *command], cwd=work_dir, check=True)
+        git = types.SimpleNamespace(open=GitRepo)
+        for patch in (mock.patch.object(app, 'Session', _session),
+                      mock.patch.object(app, '_repo_dir',
+                                        lambda _session: work_dir),
+                      mock.patch.object(app, 'GitServer', lambda _: git)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _get(self, query):
+        status = []
+        body = wsgi.app({
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': '/api/files',
+            'QUERY_STRING': query, 'HTTP_HOST': 'localhost',
+            'wsgi.input': io.BytesIO(),
+        }, lambda code, _headers: status.append(code))
+        data = b''.join(body)
+        self.assertEqual(status, ['200 OK'], data)
+        return json.loads(data)
+
+    def test_all(self):
+        result = self._get('')
+        self.assertEqual(result['total'], 4)
+        self.assertEqual([*result['files']], ['a', 'b', 'c/d', 'e'])
+
+    def test_paged(self):
+        result = self._get('1&2')
+        self.assertEqual(result['total'], 4)
+        self.assertEqual([*result['files']], ['b', 'c/d'])
+        self.assertEqual(self._get('-1&1')['files'], {'a': 0o644})
+        self.assertEqual(self._get('3&10')['files'], {'e': 0o644})
+
+    def test_since(self):
+        version = self._get('')['version']
+        repo = GitRepo(self.dir.name)
+        repo.remove('src/b')
+        repo.stage({'src/b': None})
+        app._journal(repo).append(['src/b'])
+        result = self._get(version)
+        self.assertEqual(result['changes'], {'b': None})
+        self.assertNotEqual(result['version'], version)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import random
+import re
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'opt',
+                                'webui'))
+
+# pylint: disable=wrong-import-position
+import pkg_index  # noqa: E402
+
+QUERIES = [
+    '', 'a', 'lib', '.*', '.*ab', '.*zzz', 'a*', 'x?', '(?i)LIB', 'lib.*-dev',
+    '(?s)a(?!.*b)', 'a(?![^z]*c)', 'a[^z]*c', '(?=b)b.', '.*(?<=c)d',
+    'a.*+', '(?>a|ab)c', 'lib[0-9]+$', r'\w+-\w+', '[a-c]{2}[^a-c]',
+]
+
+
+def _scan(names, query, first, count):
+    pat = re.compile(query)
+    found = [name for name in names if pat.match(name)]
+    return found[first:first + count]
+
+
+class PackageIndexTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = random.Random(1)
+        alphabet = 'abcdxyz-019'
+        names = {''.join(rng.choice(alphabet)
+                         for _ in range(rng.randrange(1, 12)))
+                 for _ in range(3000)}
+        names |= {'lib-dev', 'libc6', 'libfoo-dev', 'zlib1g'}
+        cls.names = sorted(names)
+        cls.dir = tempfile.TemporaryDirectory()
+        path = os.path.join(cls.dir.name, 'pkg.index')
+        pkg_index.write(path, [(name, f'{name} package', 1, [])
+                               for name in cls.names])
+        cls.index = pkg_index.PackageIndex(path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.dir.cleanup()
+
+    def test_search_matches_scan(self):
+        for query in QUERIES:
+            for first, count in ((0, 50), (0, 5000), (100, 50),
+                                 (len(self.names) - 10, 50)):
+                with self.subTest(query=query, first=first, count=count):
+                    result = self.index.search(query, first, count)
+                    self.assertEqual(
+                        [item['name'] for item in result],
+                        _scan(self.names, query, first, count)
+                    )
+
+
+if __name__ == '__main__':
+    unittest.main()
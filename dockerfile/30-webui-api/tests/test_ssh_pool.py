@@ -0,0 +1,88 @@
+import os
+import shlex
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'opt',
+                                'webui'))
+
+# pylint: disable=wrong-import-position
+from execute import ExecuteError  # noqa: E402
+from ssh_pool import SshPool  # noqa: E402
+
+# Stand-in for ssh: logs each call, answers '-O check' while 'master'
+# exists, and fails multiplexed commands with 255 while 'lost' exists.
+FAKE_SSH = '''#!/bin/sh
+dir=$(dirname "$0")
+echo "$*" >> "$dir/log"
+case " $* " in
+  *" -O check "*) test -e "$dir/master" ;;
+  *" -O "*) exit 0 ;;
+  *ControlMaster=auto*) test -e "$dir/lost" && exit 255; echo mux ;;
+  *) echo direct ;;
+esac
+'''
+
+
+class SshPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        ssh = os.path.join(self.dir.name, 'ssh')
+        with open(ssh, 'w', encoding='utf-8') as file:
+            file.write(FAKE_SSH)
+        os.chmod(ssh, 0o755)
+        self.pool = SshPool(command=shlex.quote(ssh),
+                            control_dir=os.path.join(self.dir.name, 'control'))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _touch(self, name):
+        open(os.path.join(self.dir.name, name), 'w',
+             encoding='utf-8').close()
+
+    def _log(self):
+        path = os.path.join(self.dir.name, 'log')
+        with open(path, encoding='utf-8') as file:
+            return file.read().splitlines()
+
+    def _commands(self):
+        return [line for line in self._log() if ' -O ' not in line]
+
+    def test_master_reused(self):
+        self._touch('master')
+        for _ in range(5):
+            self.assertEqual(self.pool.run('git@h', 'info'), 'mux\n')
+        checks = [line for line in self._log() if ' -O check ' in line]
+        self.assertEqual(len(checks), 1)
+        commands = self._commands()
+        self.assertEqual(len(commands), 5)
+        self.assertEqual(len(set(commands)), 1)
+        self.assertIn('ControlMaster=auto', commands[0])
+
+    def test_failed_check_cached(self):
+        for _ in range(3):
+            self.pool.run('git@h', 'info')
+        checks = [line for line in self._log() if ' -O check ' in line]
+        self.assertEqual(len(checks), 1)
+
+    def test_idempotent_retried_one_shot(self):
+        self._touch('lost')
+        self.assertEqual(self.pool.run('git@h', 'info', idempotent=True),
+                         'direct\n')
+        commands = self._commands()
+        self.assertEqual(len(commands), 2)
+        self.assertIn('ControlMaster=no', commands[1])
+        self.assertTrue(any(' -O exit ' in line for line in self._log()))
+
+    def test_non_idempotent_not_retried(self):
+        self._touch('lost')
+        with self.assertRaises(ExecuteError) as cm:
+            self.pool.run('git@h', 'perms', '+', 'WRITERS')
+        self.assertEqual(cm.exception.status, 255)
+        self.assertEqual(len(self._commands()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()